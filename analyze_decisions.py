@@ -0,0 +1,88 @@
+# analyze_decisions.py
+# --------------------
+# Offline analysis of the decision logs the agents of myTeam.py write with the log_decisions option.
+#
+# Every agent writes a line-delimited JSON file (decisions-<pid>-agent<index>.jsonl) with one record per
+# move. The logs are memory-mapped and parsed line by line, so thousands of games can be analyzed
+# without reading whole files into memory. The summary shows per strategy how often it was active,
+# how often several actions were tied for the best value and the mean of every feature of the chosen actions.
+#
+#   python tournament.py SwitchingPatrolAgent DynamicPatrolAgent --first-opts log_decisions=1,decision_log_dir=decisions
+#   python analyze_decisions.py decisions/*.jsonl
+
+import argparse
+import json
+import mmap
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+
+def load_decisions(path):
+    """
+    Yields the records of a decision log, the schema records are applied to the decisions:
+    every decision gets the feature names of its strategy.
+    """
+    names = {}
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can not be mapped
+            return
+        with data:
+            start = 0
+            while start < len(data):
+                end = data.find(b'\n', start)
+                if end == -1:
+                    # The last record of a log that is still written can be incomplete
+                    break
+                line = data[start:end]
+                start = end + 1
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record['type'] == 'schema':
+                    names[record['strategy']] = record['names']
+                    continue
+                record['names'] = names.get(record['strategy'])
+                yield record
+
+
+def summarize(paths):
+    """
+    Prints the moves, the ties and the mean features of the chosen actions of every strategy.
+    """
+    moves = defaultdict(int)
+    ties = defaultdict(int)
+    chosen_features = defaultdict(list)
+    names = {}
+    for path in paths:
+        for record in load_decisions(path):
+            strategy = record['strategy']
+            moves[strategy] += 1
+            if len(record['best_actions']) > 1:
+                ties[strategy] += 1
+            names[strategy] = record['names']
+            chosen_features[strategy].append(record['features'][record['actions'].index(record['action'])])
+
+    for strategy in sorted(moves):
+        print('%-12s %7d moves  %5.1f%% tied' % (strategy, moves[strategy], 100.0 * ties[strategy] / moves[strategy]))
+        if names[strategy] is None:
+            continue
+        means = np.mean(np.array(chosen_features[strategy]), axis=0)
+        for name, mean in zip(names[strategy], means):
+            print('    %-24s %10.3f' % (name, mean))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Summarize the decision logs of the agents in myTeam.py')
+    parser.add_argument('logs', nargs='+', help='decision log files')
+    options = parser.parse_args(argv)
+    summarize(options.logs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
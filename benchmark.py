@@ -0,0 +1,204 @@
+# benchmark.py
+# ------------
+# Headless micro-benchmark of the decision throughput of the agents in myTeam.py.
+#
+# Games on the standard capture layouts are recorded once (without graphics) and stored in
+# the .cache directory. The recorded game states are then replayed through every agent class
+# and the decisions per second, the latency distribution and the peak memory are reported.
+#
+#   python benchmark.py                   run and compare against benchmark_baseline.json
+#   python benchmark.py --save-baseline   run and store the results as the new baseline
+#
+# The exit code is 1 if any result regressed by more than the tolerance against the baseline.
+
+import argparse
+import json
+import os
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from contest.capture import GameState
+from contest.layout import get_layout
+
+import myTeam
+
+AGENT_CLASSES = ['SwitchingPatrolAgent', 'DefensivePatrolling', 'OffensivePatrolling']
+LAYOUTS = ['defaultCapture', 'mediumCapture', 'officeCapture', 'strategicCapture', 'jumboCapture']
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+def create_agents(state, agent_class):
+    """
+    Creates both teams of the given agent class and returns the agents by index.
+    Waits for the distance matrix of the layout, so its background computation does not slow down the timed moves.
+    """
+    agents = {}
+    for is_red, indices in ((True, state.get_red_team_indices()), (False, state.get_blue_team_indices())):
+        team = myTeam.create_team(indices[0], indices[1], is_red, first=agent_class, second=agent_class)
+        for agent in team:
+            agents[agent.index] = agent
+    for index in sorted(agents):
+        agents[index].register_initial_state(state.make_observation(index))
+    myTeam.get_distance_engine(state.get_walls()).wait()
+    return agents
+
+
+def record_game(layout, num_moves, seed):
+    """
+    Plays a headless game of SwitchingPatrolAgent teams and returns the list of
+    (agent index, observation) tuples of every move.
+    """
+    random.seed(seed)
+    state = GameState()
+    state.initialize(layout, 4)
+    agents = create_agents(state, 'SwitchingPatrolAgent')
+
+    observations = []
+    for move in range(num_moves):
+        index = move % len(agents)
+        observation = state.make_observation(index)
+        observations.append((index, observation))
+        state = state.generate_successor(index, agents[index].get_action(observation))
+        if state.is_over():
+            break
+    return observations
+
+
+def load_recording(layout_name, num_moves, seed):
+    """
+    Returns the recorded game of the layout, recording and caching it on the first run.
+    """
+    path = os.path.join(myTeam.CACHE_DIR, 'benchmark-%s-%d-%d.pkl' % (layout_name, num_moves, seed))
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    layout = get_layout(layout_name)
+    if layout is None:
+        return None
+    observations = record_game(layout, num_moves, seed)
+    recording = {'layout': layout, 'observations': observations}
+    os.makedirs(myTeam.CACHE_DIR, exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump(recording, f)
+    return recording
+
+
+def replay(agent_class, recording, seed):
+    """
+    Replays the recorded observations through new agents of the given class.
+    Returns the latency of every decision in seconds.
+    """
+    random.seed(seed)
+    state = GameState()
+    state.initialize(recording['layout'], 4)
+    agents = create_agents(state, agent_class)
+
+    latencies = []
+    for index, observation in recording['observations']:
+        start = time.perf_counter()
+        agents[index].choose_action(observation)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def peak_memory(agent_class, recording, seed):
+    """
+    Replays the recording once more under tracemalloc and returns the peak of allocated memory in bytes.
+    """
+    tracemalloc.start()
+    try:
+        replay(agent_class, recording, seed)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(layouts, agent_classes, num_moves, seed, measure_memory=True):
+    """
+    Returns a dict of results, keyed by 'layout/agent class'.
+    """
+    results = {}
+    for layout_name in layouts:
+        recording = load_recording(layout_name, num_moves, seed)
+        if recording is None:
+            print('Skipping unknown layout %s' % layout_name)
+            continue
+
+        for agent_class in agent_classes:
+            latencies = np.array(replay(agent_class, recording, seed))
+            result = {'decisions': len(latencies),
+                      'decisions_per_sec': float(len(latencies) / latencies.sum()),
+                      'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                      'p95_ms': float(np.percentile(latencies, 95) * 1000),
+                      'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                      'max_ms': float(latencies.max() * 1000)}
+            if measure_memory:
+                result['peak_memory_kb'] = peak_memory(agent_class, recording, seed) / 1024
+            results['%s/%s' % (layout_name, agent_class)] = result
+            print('%-40s %8.1f decisions/s  p50 %6.2f ms  p95 %6.2f ms  max %7.2f ms  %s' % (
+                '%s/%s' % (layout_name, agent_class), result['decisions_per_sec'], result['p50_ms'],
+                result['p95_ms'], result['max_ms'],
+                '%.0f kB' % result['peak_memory_kb'] if measure_memory else ''))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of messages for every result that regressed by more than the tolerance.
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        if result['decisions_per_sec'] < reference['decisions_per_sec'] * (1 - tolerance):
+            regressions.append('%s: %.1f decisions/s, baseline %.1f' % (
+                key, result['decisions_per_sec'], reference['decisions_per_sec']))
+        if result['p95_ms'] > reference['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %.2f ms, baseline %.2f ms' % (key, result['p95_ms'], reference['p95_ms']))
+        if 'peak_memory_kb' in result and 'peak_memory_kb' in reference and \
+                result['peak_memory_kb'] > reference['peak_memory_kb'] * (1 + tolerance):
+            regressions.append('%s: peak memory %.0f kB, baseline %.0f kB' % (
+                key, result['peak_memory_kb'], reference['peak_memory_kb']))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the decision throughput of the agents in myTeam.py')
+    parser.add_argument('-l', '--layouts', nargs='+', default=LAYOUTS, help='capture layouts to replay')
+    parser.add_argument('-a', '--agents', nargs='+', default=AGENT_CLASSES, help='agent classes to benchmark')
+    parser.add_argument('-m', '--moves', type=int, default=1200, help='number of moves to record per layout')
+    parser.add_argument('-s', '--seed', type=int, default=1, help='random seed of recording and replay')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slower) peak memory pass')
+    options = parser.parse_args(argv)
+
+    results = benchmark(options.layouts, options.agents, options.moves, options.seed, not options.no_memory)
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Saved baseline to %s' % options.baseline)
+        return 0
+
+    if not os.path.exists(options.baseline):
+        print('No baseline at %s, run with --save-baseline to create one' % options.baseline)
+        return 0
+
+    with open(options.baseline) as f:
+        regressions = compare(results, json.load(f), options.tolerance)
+    for message in regressions:
+        print('REGRESSION %s' % message)
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
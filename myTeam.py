@@ -20,12 +20,24 @@
 # John DeNero (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
 # For more info, see http://inst.eecs.berkeley.edu/~cs188/sp09/pacman.html
 
+import gc
+import hashlib
+import heapq
+import json
+import os
+import queue
 import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
 import contest.util as util
 
 from contest.captureAgents import CaptureAgent
 from contest.game import Directions
-from contest.util import nearestPoint
+from contest.util import nearestPoint, manhattanDistance
 
 
 #################
@@ -33,7 +45,7 @@ from contest.util import nearestPoint
 #################
 
 def create_team(first_index, second_index, is_red,
-                first='SwitchingPatrolAgent', second='SwitchingPatrolAgent', num_training=0):
+                first='SwitchingPatrolAgent', second='SwitchingPatrolAgent', num_training=0, **agent_options):
     """
     This function should return a list of two agents that will form the
     team, initialized using firstIndex and secondIndex as their agent
@@ -47,53 +59,1588 @@ def create_team(first_index, second_index, is_red,
     For the nightly contest, however, your team will be created without
     any extra arguments, so you should make sure that the default
     behavior is what you want for the nightly contest.
+
+    All other keyword arguments are passed on to both agents as options, e.g.
+    --redOpts search=alphabeta,time_for_computing=0.5
+    """
+    # Both agents share one blackboard, with the belief tracker each of them refines with its own observations
+    blackboard = TeamBlackboard()
+    return [eval(first)(first_index, blackboard=blackboard, **agent_options),
+            eval(second)(second_index, blackboard=blackboard, **agent_options)]
+
+
+#####################
+# Shared components #
+#####################
+
+# Distance stored for cells that can not be reached from any source
+UNREACHABLE = 9999
+
+# Directory of the on-disk cache of precomputed layout data
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+# Parameter file with the weight tables of the strategies, see tune_weights.py
+WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weights.json')
+
+# Loaded weight tables, by file path
+_weight_tables = {}
+
+
+def load_weights(path=None):
+    """
+    Returns the weight tables of all strategies from a parameter file, by default weights.json.
+    A file is only read once per process.
+    """
+    path = os.path.abspath(path or WEIGHTS_FILE)
+    if path not in _weight_tables:
+        with open(path) as f:
+            _weight_tables[path] = json.load(f)
+    return _weight_tables[path]
+
+
+def parse_flag(value):
+    """
+    Agent options from --redOpts/--blueOpts are strings, returns the boolean meaning of an option value.
+    """
+    if isinstance(value, str):
+        return value.lower() not in ('', '0', 'false', 'no', 'off', 'none')
+    return bool(value)
+
+
+class ProfileSection:
+    """
+    Context manager that adds the time spent in its block to the samples of a profiler section.
+    """
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.samples.append(time.perf_counter() - self.start)
+
+
+class NullSection:
+    """
+    The section of a disabled profiler, it does nothing.
+    """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_SECTION = NullSection()
+
+
+class NullProfiler:
+    """
+    The profiler of agents that are not profiled, all sections are the same no-op context manager.
+    """
+
+    enabled = False
+
+    def section(self, name):
+        return NULL_SECTION
+
+    def record(self, name, value):
+        pass
+
+    def add_statistics(self, name, statistics):
+        pass
+
+    def write(self):
+        pass
+
+
+class Profiler:
+    """
+    Collects the time spent in named sections of the hot path (choose_action, successor generation,
+    every feature and the strategy switch) during a game and writes their histograms to a JSON file.
+    The agents are reused for every game of a match, every game is written to its own file
+    (<prefix>-game<n>.json) and the samples start empty again for the next game.
+
+    Profiling is turned on with the profile option of the agents, e.g. --redOpts profile=1, and
+    profile_dir sets the directory of the output files. Disabled agents use a NullProfiler.
+    """
+
+    enabled = True
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.game = 0
+        self.samples = {}
+        self.sections = {}
+        self.statistics = {}
+
+    def section(self, name):
+        """
+        Returns the context manager that times a block as the given section.
+        """
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = ProfileSection(self.samples.setdefault(name, []))
+        return section
+
+    def record(self, name, value):
+        """
+        Records a value that is not a time (e.g. the depth of the search) with the samples of the sections.
+        """
+        self.samples.setdefault(name, []).append(value)
+
+    def summary(self):
+        """
+        Returns the count, total, p50, p95 and max of every section in seconds and of every recorded value.
+        """
+        summary = {}
+        for name, samples in sorted(self.samples.items()):
+            if len(samples) == 0:
+                continue
+            values = np.array(samples)
+            summary[name] = {'count': len(samples),
+                             'total': float(values.sum()),
+                             'p50': float(np.percentile(values, 50)),
+                             'p95': float(np.percentile(values, 95)),
+                             'max': float(values.max())}
+        summary.update(self.statistics)
+        return summary
+
+    def add_statistics(self, name, statistics):
+        """
+        Adds a dict of statistics (e.g. the hit rate of a cache) to the summary.
+        """
+        self.statistics[name] = statistics
+
+    def path(self):
+        return '%s-game%d.json' % (self.prefix, self.game)
+
+    def write(self):
+        """
+        Writes the summary of the game to its output file and starts the next game.
+        """
+        directory = os.path.dirname(self.prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path(), 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+        self.game += 1
+        self.samples = {}
+        self.sections = {}
+        self.statistics = {}
+
+
+def create_profiler(index, profile, profile_dir=None):
+    """
+    Returns the profiler for the agent options, a NullProfiler if profiling is turned off.
+    Every agent writes its own files, named after the process, the agent index and the game.
+    """
+    if not parse_flag(profile):
+        return NullProfiler()
+    if profile_dir is None:
+        profile_dir = CACHE_DIR
+    return Profiler(os.path.join(profile_dir, 'profile-%d-agent%d' % (os.getpid(), index)))
+
+
+class NullDecisionLog:
+    """
+    The decision log of agents that do not log their decisions.
+    """
+
+    enabled = False
+
+    def log(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+class DecisionLog:
+    """
+    Streams one line-delimited JSON record per move to a file, for the offline analysis of the decisions
+    with analyze_decisions.py. A record has the strategy, the feature vectors and the values of all
+    actions, the tied best actions, the chosen action and the seed of the random choice among them.
+    The names of the features of a strategy are written once in a schema record before its first decision.
+
+    The records are queued and written by a background thread to a buffered file in append mode,
+    so logging never blocks the move. Logging is turned on with the log_decisions option of the agents,
+    decision_log_dir sets the directory of the output files.
+    """
+
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self.records = queue.Queue()
+        self.schemas = set()
+        self.worker = None
+
+    def log_decision(self, index, game_state, strategy, names, features, actions, values, best_actions, action, seed):
+        """
+        Queues the record of a decision, and the schema record of the strategy the first time it decides.
+        """
+        if strategy not in self.schemas:
+            self.schemas.add(strategy)
+            self.log({'type': 'schema', 'strategy': strategy, 'names': list(names)})
+        self.log({'type': 'decision', 'agent': index, 'timeleft': game_state.data.timeleft,
+                  'score': game_state.get_score(), 'strategy': strategy, 'actions': list(actions),
+                  'features': [[float(v) for v in row] for row in features],
+                  'values': [float(v) for v in values], 'best_actions': best_actions,
+                  'action': action, 'seed': seed})
+
+    def log(self, record):
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.write_records, name='decision-log', daemon=True)
+            self.worker.start()
+        self.records.put(record)
+
+    def write_records(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', buffering=1 << 16) as f:
+            while True:
+                record = self.records.get()
+                if record is None:
+                    break
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def close(self):
+        """
+        Writes the queued records and closes the file, a later record opens it again.
+        """
+        if self.worker is not None:
+            self.records.put(None)
+            self.worker.join()
+            self.worker = None
+            # Every game appends to the file, write the schemas again for a reader that starts at a later game
+            self.schemas = set()
+
+
+def create_decision_log(index, log_decisions, decision_log_dir=None):
+    """
+    Returns the decision log for the agent options, a NullDecisionLog if logging is turned off.
+    Every agent writes its own file, named after the process and the agent index.
+    """
+    if not parse_flag(log_decisions):
+        return NullDecisionLog()
+    if decision_log_dir is None:
+        decision_log_dir = CACHE_DIR
+    return DecisionLog(os.path.join(decision_log_dir, 'decisions-%d-agent%d.jsonl' % (os.getpid(), index)))
+
+
+def bfs_distance_field(walls, sources):
+    """
+    Runs a multi-source breadth first search over the open cells of the layout.
+    Returns a (width, height) array with the maze distance of each cell to its nearest source.
+    """
+    distances = [[UNREACHABLE] * walls.height for _ in range(walls.width)]
+    queue = deque()
+    for x, y in sources:
+        distances[x][y] = 0
+        queue.append((x, y))
+
+    while queue:
+        x, y = queue.popleft()
+        next_distance = distances[x][y] + 1
+        for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if not walls[nx][ny] and distances[nx][ny] > next_distance:
+                distances[nx][ny] = next_distance
+                queue.append((nx, ny))
+
+    return np.array(distances, dtype=np.int32)
+
+
+def get_border_x(walls, red):
+    """
+    Returns the x coordinate of the border column on the own side.
+    """
+    if red:
+        return int(walls.width / 2) - 1
+    return int(walls.width / 2)
+
+
+def split_border(walls, red, team_indices):
+    """
+    Divides the open border cells into two segments, the lower half for the first agent of the team
+    and the upper half for its partner. Returns a dict with the segment of each team index.
+    """
+    border_x = get_border_x(walls, red)
+    full_y_area = int(walls.height)
+    first_agent_y_area = int(full_y_area / 2)
+
+    segments = {
+        team_indices[0]: tuple((border_x, y) for y in range(first_agent_y_area) if not walls[border_x][y]),
+        team_indices[1]: tuple((border_x, y) for y in range(first_agent_y_area, full_y_area) if not walls[border_x][y]),
+    }
+
+    # A segment without open cells falls back to the whole border
+    for index, segment in segments.items():
+        if len(segment) == 0:
+            segments[index] = tuple((border_x, y) for y in range(full_y_area) if not walls[border_x][y])
+    return segments
+
+
+class ReturnPolicy:
+    """
+    The way home of a food-carrying agent, computed once per layout and side.
+
+    A multi-source breadth first search from the open cells of the own border column gives every cell
+    the maze distance to the nearest of them, where the carried food is cashed in, and the move that
+    leads one step closer.
+
+    Attributes:
+    - distance: A (width, height) array with the distance of each cell to the own border.
+    - next_moves: A dict with the move towards the own border of each cell, STOP on the border itself.
+    """
+
+    MOVES = {(1, 0): Directions.EAST, (-1, 0): Directions.WEST, (0, 1): Directions.NORTH, (0, -1): Directions.SOUTH}
+
+    def __init__(self, walls, red):
+        border_x = get_border_x(walls, red)
+        distance = [[UNREACHABLE] * walls.height for _ in range(walls.width)]
+        self.next_moves = {}
+        queue = deque()
+        for y in range(walls.height):
+            if not walls[border_x][y]:
+                distance[border_x][y] = 0
+                self.next_moves[(border_x, y)] = Directions.STOP
+                queue.append((border_x, y))
+
+        while queue:
+            x, y = queue.popleft()
+            next_distance = distance[x][y] + 1
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if not walls[nx][ny] and distance[nx][ny] > next_distance:
+                    distance[nx][ny] = next_distance
+                    # The neighbour gets home by moving to the cell it was reached from
+                    self.next_moves[(nx, ny)] = self.MOVES[(x - nx, y - ny)]
+                    queue.append((nx, ny))
+
+        self.distance = np.array(distance, dtype=np.int32)
+
+    def distance_at(self, pos):
+        x, y = nearestPoint(pos)
+        return int(self.distance[x, y])
+
+    def next_move(self, pos):
+        return self.next_moves.get(nearestPoint(pos), Directions.STOP)
+
+
+class NearestFoodField:
+    """
+    Keeps the maze distance of every cell to the nearest food pellet.
+
+    The field is built with a multi-source breadth first search when the game starts.
+    Afterwards update() compares the new food grid with the previous one and repairs the
+    distances only around the cells where food was eaten or dropped.
+
+    Attributes:
+    - distances: A (width, height) array with the distance of each cell to the nearest food.
+    - count: The number of food pellets left.
+    """
+
+    def __init__(self, walls, food):
+        self.walls = walls
+        self.food = np.array(food.data, dtype=bool)
+        self.count = int(self.food.sum())
+        self.distances = bfs_distance_field(walls, food.as_list())
+
+    def has_food(self, pos):
+        x, y = nearestPoint(pos)
+        return bool(self.food[x, y])
+
+    def distance(self, pos):
+        """
+        Returns the maze distance from the given position to the nearest food pellet.
+        """
+        x, y = nearestPoint(pos)
+        return int(self.distances[x, y])
+
+    def distance_after_eating(self, pos):
+        """
+        Returns the maze distance to the nearest food pellet, ignoring the pellet at the given position.
+        The search stops at the first pellet, so it only visits the cells closer than that pellet.
+        """
+        start = nearestPoint(pos)
+        visited = {start}
+        queue = deque([(start, 0)])
+        while queue:
+            (x, y), distance = queue.popleft()
+            if self.food[x, y] and (x, y) != start:
+                return distance
+            for cell in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if not self.walls[cell[0]][cell[1]] and cell not in visited:
+                    visited.add(cell)
+                    queue.append((cell, distance + 1))
+        return UNREACHABLE
+
+    def update(self, food):
+        """
+        Brings the field up to date with the given food grid.
+        """
+        current = np.array(food.data, dtype=bool)
+        changed = np.argwhere(current != self.food)
+        if len(changed) == 0:
+            return
+
+        eaten = [(int(x), int(y)) for x, y in changed if self.food[x, y]]
+        dropped = [(int(x), int(y)) for x, y in changed if current[x, y]]
+        self.food = current
+        self.count = int(current.sum())
+
+        if len(eaten) > 0:
+            self.remove_food(eaten)
+        if len(dropped) > 0:
+            self.add_food(dropped)
+
+    def neighbours(self, x, y):
+        return [(nx, ny) for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)) if not self.walls[nx][ny]]
+
+    def remove_food(self, eaten):
+        """
+        Distances can only grow when food is eaten. Only the cells whose nearest pellet was eaten are
+        invalidated, they are then filled again from the valid cells around them.
+        """
+        distances = self.distances
+        invalid = set()
+        for source in eaten:
+            # The cells that had the eaten pellet as (one of) their nearest pellets
+            invalid.add(source)
+            queue = deque([source])
+            while queue:
+                x, y = queue.popleft()
+                next_distance = distances[x, y] + 1
+                for cell in self.neighbours(x, y):
+                    if cell not in invalid and distances[cell] == next_distance:
+                        invalid.add(cell)
+                        queue.append(cell)
+
+        for cell in invalid:
+            distances[cell] = UNREACHABLE
+
+        # The valid cells at the edge of the invalidated area are correct and seed the repair
+        frontier = []
+        for x, y in invalid:
+            for cell in self.neighbours(x, y):
+                if cell not in invalid and distances[cell] < UNREACHABLE:
+                    frontier.append((int(distances[cell]), cell))
+        heapq.heapify(frontier)
+
+        while frontier:
+            distance, (x, y) = heapq.heappop(frontier)
+            if distance > distances[x, y]:
+                continue
+            for cell in self.neighbours(x, y):
+                if distances[cell] > distance + 1:
+                    distances[cell] = distance + 1
+                    heapq.heappush(frontier, (distance + 1, cell))
+
+    def add_food(self, dropped):
+        """
+        Distances can only shrink when food is dropped, so a search from the new pellets is enough.
+        """
+        distances = self.distances
+        queue = deque()
+        for cell in dropped:
+            distances[cell] = 0
+            queue.append(cell)
+
+        while queue:
+            x, y = queue.popleft()
+            next_distance = distances[x, y] + 1
+            for cell in self.neighbours(x, y):
+                if distances[cell] > next_distance:
+                    distances[cell] = next_distance
+                    queue.append(cell)
+
+
+class DistanceEngine:
+    """
+    All-pairs maze distances of a layout, stored as a compact uint16 matrix over the open cells.
+
+    Use get_distance_engine() to get the engine of a layout, it is shared by all agents and
+    strategy objects of the process and the matrix is cached on disk, keyed by a hash of the walls,
+    so repeated matches on the same map only have to load it.
+    A matrix that is not cached yet is computed in a background thread, so registering an agent does
+    not block. Until it is ready, the distances from a cell are computed with a breadth first search
+    on demand and kept until the matrix replaces them.
+    The engine can be used as the distancer of a CaptureAgent.
+
+    Attributes:
+    - cells: A list with the open cells of the layout.
+    - cell_index: A (width, height) array with the row of each open cell in the matrix, -1 for walls.
+    - distances: The (cells, cells) uint16 matrix with the maze distances, None while it is computed.
+    - rows: A dict with the rows computed on demand while the matrix is not ready, by row.
+    - worker: The background thread that computes the matrix, None if it was loaded from the cache.
+    """
+
+    UNREACHABLE = np.iinfo(np.uint16).max
+
+    def __init__(self, walls):
+        self.walls = walls
+        self.open_cells = ~np.array(walls.data, dtype=bool)
+        self.cells = [(int(x), int(y)) for x, y in zip(*np.nonzero(self.open_cells))]
+        self.cell_index = np.full(self.open_cells.shape, -1, dtype=np.int32)
+        for i, (x, y) in enumerate(self.cells):
+            self.cell_index[x, y] = i
+        self.layout_hash = hashlib.sha1(
+            np.array(self.open_cells.shape).tobytes() + self.open_cells.tobytes()).hexdigest()
+        self.distances = None
+        self.rows = {}
+        self.neighbours = None
+        self.worker = None
+
+    def cache_path(self):
+        return os.path.join(CACHE_DIR, 'distances-%s.npy' % self.layout_hash)
+
+    def neighbour_lists(self):
+        """
+        Returns for every open cell the matrix rows of its open neighbours.
+        """
+        neighbours = []
+        for x, y in self.cells:
+            neighbours.append([int(self.cell_index[nx, ny]) for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1))
+                               if not self.walls[nx][ny]])
+        return neighbours
+
+    def search(self, neighbours, source):
+        """
+        Runs a breadth first search from the cell with the given row, returns the list of distances.
+        """
+        row = [self.UNREACHABLE] * len(self.cells)
+        row[source] = 0
+        queue = deque([source])
+        while queue:
+            cell = queue.popleft()
+            next_distance = row[cell] + 1
+            for neighbour in neighbours[cell]:
+                if row[neighbour] > next_distance:
+                    row[neighbour] = next_distance
+                    queue.append(neighbour)
+        return row
+
+    def compute(self):
+        """
+        Runs a breadth first search from every open cell.
+        """
+        neighbours = self.neighbour_lists()
+        n = len(self.cells)
+        distances = np.full((n, n), self.UNREACHABLE, dtype=np.uint16)
+        for source in range(n):
+            distances[source] = self.search(neighbours, source)
+        # The matrix is published at once, readers in other threads see either None or the full matrix
+        self.distances = distances
+
+    def start(self):
+        """
+        Loads the matrix from the disk cache, or starts to compute and save it in a background thread.
+        """
+        if self.load():
+            return
+        self.worker = threading.Thread(target=self.compute_and_save, name='distance-engine', daemon=True)
+        self.worker.start()
+
+    def compute_and_save(self):
+        self.compute()
+        self.save()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the background computation of the matrix is done, benchmark.py waits for it before timing moves.
+        """
+        if self.worker is not None:
+            self.worker.join(timeout)
+
+    def row(self, i):
+        """
+        Returns the distances from the cell with the given row, from the matrix if it is ready
+        and else from a breadth first search on demand.
+        """
+        distances = self.distances
+        if distances is not None:
+            if self.rows:
+                # The matrix replaces the rows computed on demand
+                self.rows = {}
+            return distances[i]
+
+        if i not in self.rows:
+            if self.neighbours is None:
+                self.neighbours = self.neighbour_lists()
+            self.rows[i] = np.array(self.search(self.neighbours, i), dtype=np.uint16)
+        return self.rows[i]
+
+    def load(self):
+        """
+        Loads the matrix from the disk cache, returns False if there is no usable cached matrix.
+        """
+        try:
+            distances = np.load(self.cache_path())
+        except (OSError, ValueError):
+            return False
+        n = len(self.cells)
+        if distances.shape != (n, n) or distances.dtype != np.uint16:
+            return False
+        self.distances = distances
+        return True
+
+    def save(self):
+        """
+        Writes the matrix to the disk cache. A read-only disk only costs the cache.
+        """
+        path = self.cache_path()
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                np.save(f, self.distances)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    def get_distance(self, pos1, pos2):
+        """
+        Returns the maze distance between two positions, positions outside the maze use the manhattan distance.
+        """
+        x1, y1 = nearestPoint(pos1)
+        x2, y2 = nearestPoint(pos2)
+        i = self.cell_index[x1, y1]
+        j = self.cell_index[x2, y2]
+        if i < 0 or j < 0:
+            return manhattanDistance(pos1, pos2)
+        if self.distances is None and i not in self.rows and j in self.rows:
+            # Distances are symmetric, reuse the row that was searched already
+            i, j = j, i
+        return int(self.row(i)[j])
+
+    def distances_from(self, pos):
+        """
+        Returns the row of the matrix with the distances from the given position to all open cells.
+        """
+        x, y = nearestPoint(pos)
+        return self.row(self.cell_index[x, y])
+
+
+# Distance engines of this process, by layout hash
+_distance_engines = {}
+
+
+def get_distance_engine(walls):
+    """
+    Returns the distance engine of the layout, loading it or starting its background computation on the first request.
+    """
+    engine = DistanceEngine(walls)
+    if engine.layout_hash in _distance_engines:
+        return _distance_engines[engine.layout_hash]
+
+    engine.start()
+    _distance_engines[engine.layout_hash] = engine
+    return engine
+
+
+class MazeTopology:
+    """
+    The topology of the maze, analyzed once per layout in linear time.
+
+    - Chokepoints are the articulation points of the maze, cells whose removal disconnects it.
+    - Dead ends are the cells that are cut off when cells with a single open neighbour are removed
+      over and over, i.e. the corridors and trees that hang off the cycles of the maze.
+    - Escape cells are all other cells, from them an agent can flee in two directions.
+
+    Use get_maze_topology() to get the shared topology of a layout.
+
+    Attributes (all (width, height) arrays, read them with the *_at methods):
+    - is_chokepoint: True for the articulation points.
+    - escape_distance: The maze distance to the nearest escape cell, 0 for escape cells.
+    - dead_end_depth: The depth of the dead end a cell is in, 0 for escape cells.
+    """
+
+    def __init__(self, walls):
+        engine = get_distance_engine(walls)
+        neighbours = engine.neighbour_lists()
+        cells = engine.cells
+        shape = (walls.width, walls.height)
+
+        self.is_chokepoint = np.zeros(shape, dtype=bool)
+        for cell in self.articulation_points(neighbours):
+            self.is_chokepoint[cells[cell]] = True
+
+        in_dead_end = self.peel_dead_ends(neighbours)
+        escape_cells = [cells[i] for i in range(len(cells)) if not in_dead_end[i]]
+        if len(escape_cells) == 0:
+            # A maze without cycles has no escape cells, nothing to score then
+            self.escape_distance = np.zeros(shape, dtype=np.int32)
+        else:
+            self.escape_distance = bfs_distance_field(walls, escape_cells)
+            self.escape_distance[~engine.open_cells] = 0
+
+        # Every connected group of dead end cells is one dead end, its depth is the longest way out
+        self.dead_end_depth = np.zeros(shape, dtype=np.int32)
+        assigned = [False] * len(cells)
+        for start in range(len(cells)):
+            if not in_dead_end[start] or assigned[start]:
+                continue
+            group = [start]
+            assigned[start] = True
+            for cell in group:
+                for neighbour in neighbours[cell]:
+                    if in_dead_end[neighbour] and not assigned[neighbour]:
+                        assigned[neighbour] = True
+                        group.append(neighbour)
+            depth = max(self.escape_distance[cells[cell]] for cell in group)
+            for cell in group:
+                self.dead_end_depth[cells[cell]] = depth
+
+    @staticmethod
+    def articulation_points(neighbours):
+        """
+        Returns the articulation points of the graph, with an iterative depth first search (Tarjan).
+        """
+        n = len(neighbours)
+        discovery = [-1] * n
+        low = [0] * n
+        parent = [-1] * n
+        points = set()
+        time_step = 0
+        for root in range(n):
+            if discovery[root] != -1:
+                continue
+            discovery[root] = low[root] = time_step
+            time_step += 1
+            root_children = 0
+            stack = [(root, iter(neighbours[root]))]
+            while stack:
+                cell, remaining = stack[-1]
+                descended = False
+                for neighbour in remaining:
+                    if discovery[neighbour] == -1:
+                        parent[neighbour] = cell
+                        discovery[neighbour] = low[neighbour] = time_step
+                        time_step += 1
+                        if cell == root:
+                            root_children += 1
+                        stack.append((neighbour, iter(neighbours[neighbour])))
+                        descended = True
+                        break
+                    elif neighbour != parent[cell]:
+                        low[cell] = min(low[cell], discovery[neighbour])
+                if descended:
+                    continue
+                stack.pop()
+                if stack:
+                    above = stack[-1][0]
+                    low[above] = min(low[above], low[cell])
+                    if above != root and low[cell] >= discovery[above]:
+                        points.add(above)
+            if root_children > 1:
+                points.add(root)
+        return points
+
+
+    @staticmethod
+    def peel_dead_ends(neighbours):
+        """
+        Removes cells with at most one remaining neighbour until none are left.
+        Returns a list with True for every removed cell.
+        """
+        degree = [len(cell_neighbours) for cell_neighbours in neighbours]
+        removed = [False] * len(neighbours)
+        queue = deque(cell for cell in range(len(neighbours)) if degree[cell] <= 1)
+        while queue:
+            cell = queue.popleft()
+            if removed[cell]:
+                continue
+            removed[cell] = True
+            for neighbour in neighbours[cell]:
+                if not removed[neighbour]:
+                    degree[neighbour] -= 1
+                    if degree[neighbour] == 1:
+                        queue.append(neighbour)
+        return removed
+
+    def is_chokepoint_at(self, pos):
+        x, y = nearestPoint(pos)
+        return bool(self.is_chokepoint[x, y])
+
+    def escape_distance_at(self, pos):
+        x, y = nearestPoint(pos)
+        return int(self.escape_distance[x, y])
+
+    def dead_end_depth_at(self, pos):
+        x, y = nearestPoint(pos)
+        return int(self.dead_end_depth[x, y])
+
+
+# Maze topologies of this process, by layout hash
+_maze_topologies = {}
+
+
+def get_maze_topology(walls):
+    """
+    Returns the topology of the layout, analyzing it on the first request.
+    """
+    layout_hash = get_distance_engine(walls).layout_hash
+    if layout_hash not in _maze_topologies:
+        _maze_topologies[layout_hash] = MazeTopology(walls)
+    return _maze_topologies[layout_hash]
+
+
+def register_capture_agent(agent, game_state):
+    """
+    Does the same as CaptureAgent.register_initial_state, but uses the shared distance engine
+    of the layout instead of computing a new distancer for every agent and strategy object.
+    """
+    agent.red = game_state.is_on_red_team(agent.index)
+    agent.register_team(agent.get_team(game_state))
+    agent.distancer = get_distance_engine(game_state.get_walls())
+
+    import __main__
+    if '_display' in dir(__main__):
+        agent.display = __main__._display
+
+
+class StateSnapshot:
+    """
+    A compact record of an observation, kept in the bounded observation history instead of the full game state.
+
+    Attributes:
+    - positions: The position of every agent, None for opponents out of sight.
+    - is_pacman: The is_pacman flag of every agent.
+    - food: The food grid of both teams as a bitset (numpy packbits of the grid in column order).
+    - score: The score of the game.
+    - noisy_distances: The noisy distances to every agent, None if the observation has none.
+    """
+
+    def __init__(self, game_state):
+        num_agents = game_state.get_num_agents()
+        self.positions = tuple(game_state.get_agent_position(i) for i in range(num_agents))
+        self.is_pacman = tuple(game_state.get_agent_state(i).is_pacman for i in range(num_agents))
+        self.food = np.packbits(np.array(game_state.data.food.data, dtype=bool)).tobytes()
+        self.score = game_state.get_score()
+        distances = game_state.get_agent_distances()
+        self.noisy_distances = tuple(distances) if distances is not None else None
+
+
+def get_capture_agent_action(agent, game_state):
+    """
+    Does the same as CaptureAgent.get_action, but keeps only the last history_size observations as
+    StateSnapshots (or as full game states with the full_history flag) if the history_size option is set.
+    """
+    if agent.history_size > 0:
+        # CaptureAgent.final resets the history to a list at the end of every game
+        if not isinstance(agent.observation_history, deque):
+            agent.observation_history = deque(maxlen=agent.history_size)
+        agent.observation_history.append(game_state if agent.full_history else StateSnapshot(game_state))
+    else:
+        agent.observation_history.append(game_state)
+
+    my_pos = game_state.get_agent_position(agent.index)
+    if my_pos != nearestPoint(my_pos):
+        # We're halfway from one position to the next
+        return game_state.get_legal_actions(agent.index)[0]
+    return agent.choose_action(game_state)
+
+
+class BeliefTracker:
+    """
+    Tracks a probability distribution over the open cells of the layout for every opponent,
+    with exact inference from the noisy distances.
+
+    The beliefs are arrays over the cells of the distance engine. Time passing is one sparse
+    transition (every opponent moves uniformly to one of its legal positions) and an observation
+    multiplies the beliefs with the likelihood of the noisy distance. One tracker is shared by
+    both teammates, each of them updates it at the start of its turn. The agents are reused for
+    every game of a match, so end_game() makes the next registration set the tracker up again.
+
+    Attributes:
+    - beliefs: A dict with the belief array of every opponent.
+    """
+
+    # The noisy distance is the manhattan distance plus a uniform noise in [-6, 6]
+    SONAR_NOISE = 6
+    # Opponents within this manhattan distance of any teammate are visible
+    SIGHT_RANGE = 5
+
+    def __init__(self):
+        self.engine = None
+        self.beliefs = {}
+
+    def register(self, agent, game_state):
+        """
+        Sets up the tracker with the layout and the initial positions once per game,
+        only the first teammate that registers does the work.
+        """
+        if self.engine is not None:
+            return
+        self.engine = get_distance_engine(game_state.get_walls())
+        self.team = agent.get_team(game_state)
+        self.opponents = agent.get_opponents(game_state)
+        self.num_agents = game_state.get_num_agents()
+        self.last_index = -1
+        self.cells = self.engine.cells
+        self.xs = np.array([x for x, y in self.cells])
+        self.ys = np.array([y for x, y in self.cells])
+
+        # Transitions as (source, destination) pairs, staying on the cell is a legal move as well
+        sources, destinations = [], []
+        for source, neighbours in enumerate(self.engine.neighbour_lists()):
+            for destination in [source] + neighbours:
+                sources.append(source)
+                destinations.append(destination)
+        self.sources = np.array(sources)
+        self.destinations = np.array(destinations)
+        self.move_probabilities = 1.0 / np.bincount(self.sources, minlength=len(self.cells))
+
+        for opponent in self.opponents:
+            self.beliefs[opponent] = self.point_mass(game_state.get_agent_state(opponent).start.get_position())
+        self.defended_food = np.array(agent.get_food_you_are_defending(game_state).data, dtype=bool)
+
+    def end_game(self):
+        """
+        Forgets the layout and the beliefs of the finished game.
+        """
+        self.engine = None
+        self.beliefs = {}
+
+    def point_mass(self, pos):
+        belief = np.zeros(len(self.cells))
+        x, y = nearestPoint(pos)
+        belief[self.engine.cell_index[x, y]] = 1.0
+        return belief
+
+    def elapse_time(self, belief):
+        weights = (belief * self.move_probabilities)[self.sources]
+        return np.bincount(self.destinations, weights=weights, minlength=len(self.cells))
+
+    def update(self, agent, game_state):
+        """
+        Updates the beliefs with the moves since the last update and with the observation of the agent.
+        """
+        # Time passes for the opponents that moved since the last update of either teammate
+        index = (self.last_index + 1) % self.num_agents
+        while index != agent.index:
+            if index in self.opponents:
+                self.beliefs[index] = self.elapse_time(self.beliefs[index])
+            index = (index + 1) % self.num_agents
+        self.last_index = agent.index
+
+        # Food that disappeared from our side was eaten by the opponent that most likely stood there
+        defended_food = np.array(agent.get_food_you_are_defending(game_state).data, dtype=bool)
+        for x, y in np.argwhere(self.defended_food & ~defended_food):
+            cell = self.engine.cell_index[x, y]
+            opponent = max(self.opponents, key=lambda o: self.beliefs[o][cell])
+            self.beliefs[opponent] = self.point_mass((x, y))
+        self.defended_food = defended_food
+
+        # Cells within sight of a teammate can only hold the opponents we see
+        in_sight = np.zeros(len(self.cells), dtype=bool)
+        for teammate in self.team:
+            tx, ty = game_state.get_agent_position(teammate)
+            in_sight |= np.abs(self.xs - tx) + np.abs(self.ys - ty) <= self.SIGHT_RANGE
+
+        mx, my = game_state.get_agent_position(agent.index)
+        manhattan_distances = np.abs(self.xs - mx) + np.abs(self.ys - my)
+        noisy_distances = game_state.get_agent_distances()
+        for opponent in self.opponents:
+            pos = game_state.get_agent_position(opponent)
+            if pos is not None:
+                self.beliefs[opponent] = self.point_mass(pos)
+                continue
+
+            likelihood = (np.abs(manhattan_distances - noisy_distances[opponent]) <= self.SONAR_NOISE) & ~in_sight
+            belief = self.beliefs[opponent] * likelihood
+            if belief.sum() == 0:
+                # We lost track of the opponent (e.g. it was eaten), start over from the observation
+                belief = likelihood.astype(np.float64)
+            if belief.sum() > 0:
+                self.beliefs[opponent] = belief / belief.sum()
+
+    def most_likely_position(self, opponent):
+        return self.cells[int(np.argmax(self.beliefs[opponent]))]
+
+    def expected_distance(self, opponent, pos):
+        """
+        Returns the expected maze distance from the given position to the opponent.
+        """
+        return float(self.beliefs[opponent] @ self.engine.distances_from(pos))
+
+
+class TeamBlackboard:
+    """
+    A blackboard shared by both agents of a team, created by create_team.
+
+    Facts that do not change during the game, like the division of the border and the way home, are
+    computed once per game for both agents. Agents post their intentions (e.g. the current strategy)
+    on the blackboard for the teammate to read.
+    The agents are reused for every game of a match, end_game() clears the blackboard for the next one.
+
+    Attributes:
+    - beliefs: The BeliefTracker of the opponent positions, owned by the blackboard.
+    - game_facts: A dict with the memoized facts of the whole game.
+    - intentions: A dict with the posted intentions of every agent, by agent index.
+    """
+
+    def __init__(self, beliefs=None):
+        self.beliefs = beliefs if beliefs is not None else BeliefTracker()
+        self.game_facts = {}
+        self.intentions = {}
+
+    def end_game(self):
+        """
+        Forgets the facts, the intentions and the beliefs of the finished game.
+        """
+        self.game_facts = {}
+        self.intentions = {}
+        self.beliefs.end_game()
+
+    def game_fact(self, name, compute):
+        """
+        Returns a fact that does not change during the game, computing it with compute() on the first request.
+        """
+        if name not in self.game_facts:
+            self.game_facts[name] = compute()
+        return self.game_facts[name]
+
+    def border_segments(self, walls, red, team_indices):
+        """
+        Returns the division of the border into the segments of both agents.
+        """
+        return self.game_fact('border_segments', lambda: split_border(walls, red, team_indices))
+
+    def return_policy(self, walls, red):
+        """
+        Returns the ReturnPolicy of the team, the way home to the own border from every cell.
+        """
+        return self.game_fact('return_policy', lambda: ReturnPolicy(walls, red))
+
+    def border_distance(self, walls, red):
+        """
+        Returns the distance field to the whole border, which is patrolled alone if the partner does not defend.
+        """
+        return self.return_policy(walls, red).distance
+
+    def post(self, index, name, value):
+        """
+        Posts an intention of the agent with the given index.
+        """
+        self.intentions.setdefault(index, {})[name] = value
+
+    def read(self, index, name, default=None):
+        """
+        Returns the posted intention of the agent with the given index, or default if it did not post it.
+        """
+        return self.intentions.get(index, {}).get(name, default)
+
+
+class Situation:
+    """
+    A snapshot of the situation of an agent at the start of its turn.
+
+    It is computed once before the actions are scored, the strategy of the turn is chosen from it
+    and the strategy objects read the flags of their owner from it.
+
+    Attributes:
+    - in_lead: True if the team is in the lead.
+    - invaders: True if there are any visible invaders in the own area.
+    - enemies_near: True if any enemy is visible or expected within 10 steps.
+    - has_food: True if the agent collected food that it still has to bring back.
+    """
+
+    def __init__(self, in_lead, invaders, enemies_near, has_food):
+        self.in_lead = in_lead
+        self.invaders = invaders
+        self.enemies_near = enemies_near
+        self.has_food = has_food
+
+
+class FeatureSchema:
+    """
+    A fixed order of the feature names of a strategy, taken from the keys of its weights.
+
+    Feature counters of several actions are written into the rows of one array, so all actions
+    can be scored with a single matrix-vector product. Features without a weight are ignored,
+    like in the multiplication of a counter with the weights.
+    """
+
+    def __init__(self, weights):
+        self.names = tuple(weights)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.weights = np.array([weights[name] for name in self.names], dtype=np.float64)
+
+    def matrix(self, feature_counters):
+        """
+        Returns an (actions, features) array with one feature vector per row.
+        """
+        rows = np.zeros((len(feature_counters), len(self.names)), dtype=np.float64)
+        for row, features in zip(rows, feature_counters):
+            for name, value in features.items():
+                position = self.positions.get(name)
+                if position is not None:
+                    row[position] = value
+        return rows
+
+    def score(self, feature_counters):
+        """
+        Returns the linear combination of features and weights for every feature counter.
+        """
+        return self.matrix(feature_counters) @ self.weights
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the deadline of the move is reached.
+    """
+
+
+class AnytimeSearch:
+    """
+    An anytime, iteratively deepening search over generate_successor.
+
+    Every iteration looks one own move further ahead, with the replies of the opponents that are
+    visible in between. In 'alphabeta' mode the opponents minimize the value, in 'expectimax' mode
+    they move uniformly at random. The leaf heuristic is the evaluation of the agent, so a depth of 1
+    is the greedy one-ply evaluation. The values of the deepest iteration that finished before the
+    deadline are returned, the first iteration always finishes. The deadline is checked before every
+    expanded node and every evaluated leaf action. The depth and the nodes of every move are recorded
+    by the profiler of the agent as search.depth and search.nodes.
+
+    Attributes:
+    - depth: The depth reached in the last move.
+    - nodes: The number of nodes expanded in the last move.
+    """
+
+    MODES = ('alphabeta', 'expectimax')
+
+    def __init__(self, agent, mode='alphabeta', max_depth=8):
+        if mode not in self.MODES:
+            raise ValueError('Unknown search mode %s, use one of %s' % (mode, ', '.join(self.MODES)))
+        self.agent = agent
+        self.mode = mode
+        self.max_depth = max_depth
+        self.deadline = None
+        self.depth = 0
+        self.nodes = 0
+
+    def evaluate_actions(self, game_state, actions, deadline):
+        """
+        Returns the values of the actions from the deepest search that finished before the deadline.
+        """
+        self.deadline = deadline
+        self.nodes = 0
+        values = self.agent.evaluate_actions(game_state, actions)
+        self.depth = 1
+
+        for depth in range(2, self.max_depth + 1):
+            # Search the best actions of the last iteration first to get more cut-offs
+            order = sorted(range(len(actions)), key=lambda i: -values[i])
+            try:
+                deeper_values = self.root_values(game_state, [actions[i] for i in order], depth)
+            except SearchTimeout:
+                break
+            values = np.zeros(len(actions), dtype=np.float64)
+            values[order] = deeper_values
+            self.depth = depth
+
+        self.agent.profiler.record('search.depth', self.depth)
+        self.agent.profiler.record('search.nodes', self.nodes)
+        return values
+
+    def root_values(self, game_state, actions, depth):
+        """
+        Returns the values of the root actions. Actions that are cut off get a bound below the best value,
+        the window only prunes strictly worse actions so the cut-offs never tie with the best actions.
+        """
+        values = []
+        alpha = -float('inf')
+        for action in actions:
+            successor = self.expand(game_state, self.agent.index, action)
+            value = self.opponent_value(successor, self.agent.get_opponents(game_state), depth - 1,
+                                        np.nextafter(alpha, -np.inf), float('inf'))
+            values.append(value)
+            alpha = max(alpha, value)
+        return values
+
+    def check_deadline(self):
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    def expand(self, game_state, index, action):
+        self.check_deadline()
+        self.nodes += 1
+        if index == self.agent.index:
+            return self.agent.get_successor(game_state, action)
+        return game_state.generate_successor(index, action)
+
+    def max_value(self, game_state, depth, alpha, beta):
+        actions = game_state.get_legal_actions(self.agent.index)
+        if depth == 1 or game_state.is_over():
+            # Leaf: the greedy one-ply evaluation of the agent
+            return max(self.agent.evaluate_actions(game_state, actions, self.check_deadline))
+
+        value = -float('inf')
+        for action in actions:
+            successor = self.expand(game_state, self.agent.index, action)
+            value = max(value, self.opponent_value(successor, self.agent.get_opponents(game_state), depth - 1, alpha, beta))
+            if self.mode == 'alphabeta':
+                if value >= beta:
+                    return value
+                alpha = max(alpha, value)
+        return value
+
+    def opponent_value(self, game_state, opponents, depth, alpha, beta):
+        """
+        Lets the visible opponents reply one after another, opponents that are not visible do not move.
+        """
+        visible = [i for i in opponents if game_state.get_agent_position(i) is not None]
+        if len(visible) == 0 or game_state.is_over():
+            return self.max_value(game_state, depth, alpha, beta)
+
+        opponent = visible[0]
+        actions = game_state.get_legal_actions(opponent)
+        if self.mode == 'expectimax':
+            values = [self.opponent_value(self.expand(game_state, opponent, a), visible[1:], depth, alpha, beta)
+                      for a in actions]
+            return sum(values) / len(values)
+
+        value = float('inf')
+        for action in actions:
+            successor = self.expand(game_state, opponent, action)
+            value = min(value, self.opponent_value(successor, visible[1:], depth, alpha, beta))
+            if value <= alpha:
+                return value
+            beta = min(beta, value)
+        return value
+
+
+def generate_grid_successor(game_state, index, action):
+    """
+    Finds the next successor which is a grid position (location tuple).
+    """
+    successor = game_state.generate_successor(index, action)
+    pos = successor.get_agent_state(index).get_position()
+    if pos != nearestPoint(pos):
+        # Only half a grid position was covered
+        return successor.generate_successor(index, action)
+    else:
+        return successor
+
+
+class SuccessorCache:
+    """
+    A turn-scoped cache of successor states, shared by an agent and its strategy objects.
+
+    Successors are keyed by (state, agent index, action), so every object asking for the
+    same successor during a turn gets the already generated one. The cache has to be
+    cleared with end_turn() once the action is chosen.
+
+    Attributes:
+    - stats: A counter with the hits and misses of the current turn, recorded by the profiler
+      as successor_cache.hits and successor_cache.misses at the end of the turn.
+    """
+
+    def __init__(self, profiler=None):
+        self.successors = {}
+        self.stats = util.Counter()
+        self.profiler = profiler if profiler is not None else NullProfiler()
+
+    def get_successor(self, game_state, index, action):
+        """
+        Returns the cached successor, generating it on the first request of the turn.
+        """
+        key = (id(game_state), index, action)
+        entry = self.successors.get(key)
+        if entry is not None and entry[0] is game_state:
+            self.stats['hits'] += 1
+            return entry[1]
+
+        self.stats['misses'] += 1
+        with self.profiler.section('successor'):
+            successor = generate_grid_successor(game_state, index, action)
+        # Keep a reference to the state so its id can not be reused during the turn
+        self.successors[key] = (game_state, successor)
+        return successor
+
+    def end_turn(self):
+        """
+        Clears the cache and records the hits and misses of the finished turn.
+        """
+        self.profiler.record('successor_cache.hits', self.stats['hits'])
+        self.profiler.record('successor_cache.misses', self.stats['misses'])
+        self.stats = util.Counter()
+        self.successors = {}
+
+
+class EvaluationCache:
+    """
+    A bounded cache of the evaluated values and feature vectors of actions, shared by an agent and its strategy objects.
+
+    The same positions come up again and again (patrolling back and forth at the border, approaching
+    the same food), so values are kept across turns. They are keyed by a compact state key, see
+    DynamicPatrolAgent.evaluation_key, and the action. The least recently used values are evicted
+    when the cache is full.
+
+    Attributes:
+    - size: The maximum number of values in the cache.
+    - values: An OrderedDict with the cached (value, feature vector) tuples, the least recently used first.
+    - stats: A counter with the hits and misses of the game, reset when the profile of the game is written.
     """
-    return [eval(first)(first_index), eval(second)(second_index)]
+
+    def __init__(self, size):
+        self.size = size
+        self.values = OrderedDict()
+        self.stats = util.Counter()
+
+    def get(self, key):
+        """
+        Returns the cached entry of the key, None if it is not cached.
+        """
+        value = self.values.get(key)
+        if value is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self.values.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.values[key] = value
+        self.values.move_to_end(key)
+        if len(self.values) > self.size:
+            self.values.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups > 0 else 0.0
+
+    def summary(self):
+        return {'hits': self.stats['hits'], 'misses': self.stats['misses'],
+                'hit_rate': self.hit_rate(), 'entries': len(self.values)}
+
+    def reset_stats(self):
+        self.stats = util.Counter()
+
+
+def create_evaluation_cache(eval_cache_size):
+    """
+    Returns the evaluation cache for the agent options, None if the cache is turned off.
+    """
+    size = int(eval_cache_size)
+    return EvaluationCache(size) if size > 0 else None
 
 
 ##########
 # Agents #
 ##########
 
-class DynamicPatrolAgent(CaptureAgent): 
+class TeamAgent(CaptureAgent):
+    """
+    The turn skeleton shared by DynamicPatrolAgent and SwitchingPatrolAgent, so both of them handle
+    the agent options and play their turns the same way.
+
+    A turn updates the beliefs, prepares the turn with begin_turn(), scores the legal actions with the
+    anytime search or evaluate_actions(), lets the strategy of the turn break the ties among the best actions,
+    picks one of them with a per-move seed, logs the decision and ends the turn with end_turn().
+    Subclasses implement turn_strategy() and evaluate_actions(), and extend begin_turn() and end_turn().
+
+    Attributes:
+    - blackboard: The TeamBlackboard shared with the teammate.
+    - beliefs: The BeliefTracker of the opponent positions, owned by the blackboard.
+    - search: The optional AnytimeSearch used instead of the one-ply evaluation.
+    - profiler: The Profiler of the hot path if the profile option is set, else a NullProfiler.
+    - successor_cache: The turn-scoped successor cache.
+    - evaluation_cache: The optional EvaluationCache of action values.
+    - decision_log: The DecisionLog of the moves if the log_decisions option is set, else a NullDecisionLog.
+    - history_size: The number of observations kept in the history, 0 keeps all of them.
+    - full_history: Keeps full game states instead of StateSnapshots in the bounded history, for debugging.
+    - check_evaluation: Checks every result of evaluate_actions against evaluate, for debugging.
+    - search_margin: The seconds of time_for_computing the search leaves for ending the turn, on top of
+      the longest end of a turn among the last moves.
+    """
+
+    def __init__(self, index, time_for_computing=.1, blackboard=None, search=None, search_depth=8, search_margin=.01,
+                 profiler=None, profile=False, profile_dir=None, successor_cache=None,
+                 evaluation_cache=None, eval_cache_size=0, decision_log=None, log_decisions=False,
+                 decision_log_dir=None, history_size=0, full_history=False, check_evaluation=False):
+        super().__init__(index, float(time_for_computing))
+        # Opt-in bounded observation history, 0 keeps every full game state like CaptureAgent
+        self.history_size = int(history_size)
+        self.full_history = parse_flag(full_history)
+        # Opt-in check of the vectorized evaluation against the Counter reference evaluate
+        self.check_evaluation = parse_flag(check_evaluation)
+        self.blackboard = blackboard if blackboard is not None else TeamBlackboard()
+        self.beliefs = self.blackboard.beliefs
+        # Optional anytime search that spends time_for_computing on looking ahead
+        self.search = AnytimeSearch(self, search, int(search_depth)) if search else None
+        self.search_margin = float(search_margin)
+        # Releasing the states of a deep search takes time as well, the deadline leaves room for it
+        self.end_turn_times = deque(maxlen=10)
+        self.turn_start = None
+        # Strategy objects share the profiler, the caches and the decision log of the agent that owns them
+        self.profiler = profiler if profiler is not None else create_profiler(index, profile, profile_dir)
+        self.successor_cache = successor_cache if successor_cache is not None else SuccessorCache(self.profiler)
+        # Optional cache of the evaluated values across turns, eval_cache_size=0 turns it off
+        self.evaluation_cache = evaluation_cache if evaluation_cache is not None else create_evaluation_cache(eval_cache_size)
+        self.decision_log = decision_log if decision_log is not None else \
+            create_decision_log(index, log_decisions, decision_log_dir)
+
+    def get_action(self, game_state):
+        """
+        Records the observation in the (optionally bounded) history and chooses an action.
+        The time of the move starts here, the search deadline is measured from it.
+
+        The cyclic garbage collector is paused during the move: the successors of a turn form no cycles,
+        but their allocations set off full collections that stall the move for tens of milliseconds.
+        The turn releases its states before the collector is enabled again.
+        """
+        self.turn_start = time.perf_counter()
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return get_capture_agent_action(self, game_state)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def choose_action(self, game_state):
+        """
+        Picks among the actions with the highest Q(s,a) depending on the strategy of the turn.
+        The evaluation time can be profiled with the profile option.
+        """
+        with self.profiler.section('choose_action'):
+            with self.profiler.section('beliefs'):
+                self.beliefs.update(self, game_state)
+            self.begin_turn(game_state)
+            strategy = self.turn_strategy()
+
+            actions = game_state.get_legal_actions(self.index)
+            if self.search is not None:
+                values = self.search.evaluate_actions(game_state, actions, self.search_deadline())
+            else:
+                values = self.evaluate_actions(game_state, actions)
+
+            max_value = max(values)
+            best_actions = strategy.break_ties(game_state, [a for a, v in zip(actions, values) if v == max_value])
+
+            # The choice among the best actions is seeded per move, so the decision log can reproduce it
+            seed = random.getrandbits(32)
+            action = random.Random(seed).choice(best_actions)
+            if self.decision_log.enabled:
+                strategy.log_decision(game_state, actions, values, best_actions, action, seed)
+
+            end_turn_start = time.perf_counter()
+            self.end_turn()
+            self.end_turn_times.append(time.perf_counter() - end_turn_start)
+            return action
+
+    def search_deadline(self):
+        """
+        Returns the time the search has to stop at, so the move still returns within time_for_computing.
+        """
+        start = self.turn_start if self.turn_start is not None else time.perf_counter()
+        teardown = max(self.end_turn_times) if self.end_turn_times else 0.0
+        return start + self.time_for_computing - self.search_margin - teardown
+
+    def begin_turn(self, game_state):
+        """
+        Prepares the turn after the beliefs are updated and before the actions are scored.
+        """
+        pass
+
+    def turn_strategy(self):
+        """
+        Returns the strategy object that breaks the ties and logs the decision of the turn.
+        """
+        raise NotImplementedError
+
+    def end_turn(self):
+        """
+        Clears the successor cache once the action is chosen.
+        """
+        self.successor_cache.end_turn()
+
+    def final(self, game_state):
+        """
+        Writes the profile of the game, if the agent is profiled, and the rest of the decision log.
+        """
+        if self.evaluation_cache is not None:
+            self.profiler.add_statistics('evaluation_cache', self.evaluation_cache.summary())
+            self.evaluation_cache.reset_stats()
+        self.profiler.write()
+        self.decision_log.close()
+        self.blackboard.end_game()
+        CaptureAgent.final(self, game_state)
+
+
+class DynamicPatrolAgent(TeamAgent): 
     ''' 
     A base class for dynamic patrol agents that choose score-maximizing actions
     Based on the ReflexCaptureAgent from baselineTeam.py
     '''
 
-    def __init__(self, index, time_for_computing=.1):
-        super().__init__(index, time_for_computing)
+    # Name of the weight table of the strategy in the weights file
+    WEIGHTS_KEY = 'dynamic'
+
+    def __init__(self, index, time_for_computing=.1, weights=None, **kwargs):
+        super().__init__(index, time_for_computing, **kwargs)
         self.start = None
         self.has_food = False
+        self.weights = load_weights(weights)[self.WEIGHTS_KEY]
+        self.feature_schema = None
+        # Snapshot of the turn, set by the agent that owns this strategy object
+        self.situation = None
+        # Observation of the turn and the feature matrix of its actions, kept for the decision log
+        self.turn_state = None
+        self.turn_features = None
     
     def register_initial_state(self, game_state):
         self.start = game_state.get_agent_position(self.index)
-        CaptureAgent.register_initial_state(self, game_state)
-  
-    def choose_action(self, game_state):
-        """
-        Picks among the actions with the highest Q(s,a) depending on the current strategy.
-        """
-        actions = game_state.get_legal_actions(self.index)
+        register_capture_agent(self, game_state)
+        self.beliefs.register(self, game_state)
 
-        # You can profile your evaluation time by uncommenting these lines
-        # start = time.time()
-        values = [self.evaluate(game_state, a) for a in actions]
-        # print 'eval time for agent %d: %.4f' % (self.index, time.time() - start)
+    def begin_turn(self, game_state):
+        self.turn_state = game_state
 
-        max_value = max(values)
-        best_actions = [a for a, v in zip(actions, values) if v == max_value]
+    def turn_strategy(self):
+        return self
 
+    def end_turn(self):
+        TeamAgent.end_turn(self)
+        self.release_turn()
 
-        
-        return random.choice(best_actions)
+    def break_ties(self, game_state, best_actions):
+        """
+        Returns the actions to choose from among the actions with the highest value, all of them by default.
+        """
+        return best_actions
+
+    def log_decision(self, game_state, actions, values, best_actions, action, seed):
+        """
+        Logs the decision of the turn with the feature vectors of all actions in the order of the feature schema.
+        The feature matrix is the one evaluate_actions built for the observation of the turn.
+        """
+        schema = self.get_feature_schema()
+        self.decision_log.log_decision(self.index, game_state, self.WEIGHTS_KEY, schema.names, self.turn_features,
+                                       actions, values, best_actions, action, seed)
+
+    def release_turn(self):
+        """
+        Releases the observation of the turn, so the state is not kept alive until the next turn.
+        """
+        self.turn_state = None
+        self.turn_features = None
 
     def get_weights(self, game_state, action):
         """
         Normally, weights do not depend on the game state.  They can be either
-        a counter or a dictionary.
+        a counter or a dictionary. They are read from the weights file (weights option).
         """
-        return {'successor_score': 1.0}
+        return self.weights
     
     
     def get_features(self, game_state, action):
@@ -106,25 +1653,124 @@ class DynamicPatrolAgent(CaptureAgent):
     def evaluate(self, game_state, action):
         """
         Computes a linear combination of features and feature weights
+        This is the reference for evaluate_actions, which gives the same values for all actions at once.
         """
         features = self.get_features(game_state, action)
         weights = self.get_weights(game_state, action)
         return features * weights
+
+    def is_carrying_food(self):
+        """
+        Returns the has_food flag of the turn snapshot, or the own flag if the agent plays on its own.
+        """
+        if self.situation is not None:
+            return self.situation.has_food
+        return self.has_food
+
+    def get_feature_schema(self):
+        """
+        Returns the feature schema of the strategy, it is built once as the weights do not depend on the game state.
+        """
+        if self.feature_schema is None:
+            self.feature_schema = FeatureSchema(self.get_weights(None, None))
+        return self.feature_schema
+
+    def evaluate_actions(self, game_state, actions, check_deadline=None):
+        """
+        Computes the linear combination of features and feature weights for all actions with one matrix-vector product.
+        With the evaluation cache only the actions without a cached value and feature vector are evaluated.
+        The feature matrix of the observation of the turn is kept in turn_features.
+        The optional check_deadline of a search is called before the features of every action are computed.
+        With the check_evaluation option the values are checked against evaluate.
+        """
+        schema = self.get_feature_schema()
+        cache = self.evaluation_cache
+        if cache is None:
+            features = schema.matrix(self.action_features(game_state, actions, check_deadline))
+            if game_state is self.turn_state:
+                self.turn_features = features
+            values = features @ schema.weights
+        else:
+            key = self.evaluation_key(game_state)
+            entries = [cache.get((key, a)) for a in actions]
+            missing = [i for i, entry in enumerate(entries) if entry is None]
+            if len(missing) > 0:
+                features = schema.matrix(self.action_features(game_state, [actions[i] for i in missing], check_deadline))
+                for i, row, value in zip(missing, features, features @ schema.weights):
+                    entries[i] = (float(value), row)
+                    cache.put((key, actions[i]), entries[i])
+            if game_state is self.turn_state:
+                self.turn_features = np.array([row for value, row in entries])
+            values = [value for value, row in entries]
+
+        if self.check_evaluation:
+            self.check_values(game_state, actions, values)
+        return values
+
+    def check_values(self, game_state, actions, values):
+        """
+        Raises an AssertionError if the values of evaluate_actions differ from the values of evaluate,
+        which is the reference implementation. Used by the check_evaluation option.
+        """
+        expected = [self.evaluate(game_state, a) for a in actions]
+        if not np.allclose(values, expected, rtol=1e-9, atol=1e-9):
+            raise AssertionError('evaluate_actions of the %s strategy differs from evaluate for %s: %s != %s'
+                                 % (self.WEIGHTS_KEY, actions, list(values), expected))
+
+    def action_features(self, game_state, actions, check_deadline=None):
+        """
+        Returns the feature counters of the actions, calling check_deadline before each of them if it is given.
+        """
+        features = []
+        for action in actions:
+            if check_deadline is not None:
+                check_deadline()
+            features.append(self.get_features(game_state, action))
+        return features
+
+    def evaluation_key(self, game_state):
+        """
+        Returns a compact key of everything the features of the strategy depend on: the own position and
+        direction, the enemy positions (visible or most likely), the scared timers, the food and capsules,
+        the has_food flag, the score and the strategies posted by the team.
+        """
+        my_state = game_state.get_agent_state(self.index)
+        enemies = []
+        for opponent in self.get_opponents(game_state):
+            pos = game_state.get_agent_position(opponent)
+            # Visible enemies are scored differently than estimated ones on the same cell
+            if pos is not None:
+                enemies.append((pos, True))
+            else:
+                enemies.append((self.beliefs.most_likely_position(opponent), False))
+        num_agents = game_state.get_num_agents()
+        return (self.WEIGHTS_KEY,
+                my_state.get_position(),
+                my_state.configuration.direction,
+                tuple(enemies),
+                tuple(game_state.get_agent_state(i).is_pacman for i in range(num_agents)),
+                tuple(game_state.get_agent_state(i).scared_timer for i in range(num_agents)),
+                self.food_key(game_state),
+                self.is_carrying_food(),
+                game_state.get_score(),
+                tuple(self.blackboard.read(i, 'strategy') for i in self.get_team(game_state)))
+
+    def food_key(self, game_state):
+        """
+        Returns a hash of the food and the capsules of the state.
+        """
+        food = np.packbits(np.array(game_state.data.food.data, dtype=bool)).tobytes()
+        return hash((food, tuple(game_state.get_capsules())))
     
     def get_successor(self, game_state, action):
         """
         Finds the next successor which is a grid position (location tuple).
+        The successor is shared through the successor cache for the rest of the turn.
         """
-        successor = game_state.generate_successor(self.index, action)
-        pos = successor.get_agent_state(self.index).get_position()
-        if pos != nearestPoint(pos):
-            # Only half a grid position was covered
-            return successor.generate_successor(self.index, action)
-        else:
-            return successor
+        return self.successor_cache.get_successor(game_state, self.index, action)
 
 
-class SwitchingPatrolAgent(CaptureAgent):
+class SwitchingPatrolAgent(TeamAgent):
     """
     A class representing a switching patrol agent in a Pacman game.
 
@@ -140,32 +1786,43 @@ class SwitchingPatrolAgent(CaptureAgent):
     - is_in_lead: A flag indicating whether the agent is in the lead.
     - defensive_strategy: An instance of the DefensivePatrolling strategy.
     - offensive_strategy: An instance of the OffensivePatrolling strategy.
-    - food_list: A list of food positions in the game.
+    - food_count: The number of food pellets left when the agent last started collecting food.
+    - situation: The snapshot of the current turn, shared with both strategies.
+    - The blackboard, the search, the profiler, the caches and the decision log of TeamAgent, shared with both strategies.
 
     Methods:
     - register_initial_state(game_state): Registers the initial state of the agent.
-    - choose_action(game_state): Chooses an action based on the current strategy.
+    - begin_turn(game_state): Analyzes the situation and decides on the strategy of the turn.
+    - turn_strategy(): Returns the current strategy.
+    - end_turn(): Clears the successor cache and releases the turn of both strategies.
+    - analyze_situation(game_state): Computes the snapshot of the turn the strategy is chosen from.
+    - update_food_flags(game_state, in_lead): Updates has_food and is_in_lead.
     - get_weights(game_state, action): Returns weights depending on the current strategy.
     - get_features(game_state, action): Returns features depending on the current strategy.
     - evaluate(game_state, action): Computes a linear combination of features and feature weights.
+    - evaluate_actions(game_state, actions): Computes the same values as evaluate for all actions at once.
     - get_successor(game_state, action): Finds the next successor which is a grid position.
     - check_if_in_lead(game_state): Returns True if the agent is in the lead.
     - check_for_invaders(successor): Returns True if there are any invaders, meaning enemies that are in the agent area.
     - enemies_near(game_state): Returns True if there are any enemies near the agent.
-    - should_switch_strategy(game_state, action): Returns True if the agent should switch to another strategy.
+    - should_switch_strategy(situation): Returns True if the agent should switch to another strategy.
     - switch_to_offensive(): Switches to the offensive strategy.
     - switch_to_defensive(): Switches to the defensive strategy.
     - switch_strategy(): Switches to the other strategy.
     """
     
-    def __init__(self, index, time_for_computing=0.1):
-        super().__init__(index, time_for_computing)
+    def __init__(self, index, time_for_computing=0.1, weights=None, return_policy=True, **kwargs):
+        super().__init__(index, time_for_computing, **kwargs)
         self.start = None
         self.current_strategy = None
         self.has_food = False
         self.is_in_lead = False
-        self.defensive_strategy = DefensivePatrolling(self.index)
-        self.offensive_strategy = OffensivePatrolling(self.index)
+        self.situation = None
+        shared = dict(blackboard=self.blackboard, profiler=self.profiler, successor_cache=self.successor_cache,
+                      evaluation_cache=self.evaluation_cache, decision_log=self.decision_log, weights=weights,
+                      check_evaluation=self.check_evaluation)
+        self.defensive_strategy = DefensivePatrolling(self.index, **shared)
+        self.offensive_strategy = OffensivePatrolling(self.index, return_policy=return_policy, **shared)
 
     def register_initial_state(self, game_state):
         """
@@ -173,46 +1830,74 @@ class SwitchingPatrolAgent(CaptureAgent):
         With the instance of the defensive and offensive strategy.
         """
         self.start = game_state.get_agent_position(self.index)
-        CaptureAgent.register_initial_state(self, game_state)
+        register_capture_agent(self, game_state)
+        self.beliefs.register(self, game_state)
+        # Every game starts offensive, the strategy is posted on the blackboard of the new game
+        self.current_strategy = None
         self.defensive_strategy.register_initial_state(game_state)
         self.offensive_strategy.register_initial_state(game_state)
-        self.food_list = self.get_food(game_state).as_list()
+        self.food_count = self.offensive_strategy.food_field.count
 
-    def choose_action(self, game_state):
+    def begin_turn(self, game_state):
         """
-        Picks among the actions depending on the current strategy.
+        Analyzes the situation and decides on the strategy of the turn once, both strategies read the snapshot.
+        """
+        self.situation = self.analyze_situation(game_state)
+        with self.profiler.section('switch_strategy'):
+            if self.should_switch_strategy(self.situation):  # Switch strategy if necessary
+                self.switch_strategy()
+        for strategy in (self.defensive_strategy, self.offensive_strategy):
+            strategy.situation = self.situation
+            strategy.turn_state = game_state
+
+    def turn_strategy(self):
+        return self.current_strategy
+
+    def end_turn(self):
+        TeamAgent.end_turn(self)
+        self.defensive_strategy.release_turn()
+        self.offensive_strategy.release_turn()
+
+    def analyze_situation(self, game_state):
+        """
+        Computes the lead, invaders, enemy proximity and carried food once per turn.
+        """
+        in_lead = self.check_if_in_lead(game_state)
+        self.update_food_flags(game_state, in_lead)
+        return Situation(in_lead=in_lead,
+                         invaders=self.check_for_invaders(game_state),
+                         enemies_near=self.enemies_near(game_state),
+                         has_food=self.has_food)
+
+    def update_food_flags(self, game_state, in_lead):
+        """
+        Updates has_food and is_in_lead with the food that was eaten and brought back.
         """
-        actions = game_state.get_legal_actions(self.index)
-        values = [self.evaluate(game_state, a) for a in actions]
-        max_value = max(values)
-
-        best_actions = [a for a, v in zip(actions, values) if v == max_value]
-
         # check if we ate food as a result of the offensive strategy
-        if len(self.food_list) > len(self.get_food(game_state).as_list()):
+        self.offensive_strategy.update_food_field(game_state)
+        food_count = self.offensive_strategy.food_field.count
+        if self.food_count > food_count:
             self.has_food = True
 
         # Once we ate food we want to bring it back fast to our own area
         # Then we are in lead, if the enemy scores points we want to get another food pellet and bring it back
         # for that we save in a variable if we get in lead after bringing a food pellet back
-        if self.has_food and self.check_if_in_lead(game_state) and not self.is_in_lead:
+        if self.has_food and in_lead and not self.is_in_lead:
             self.is_in_lead = True
 
         # If we arent in lead anymore we want to get another food pellet and bring it back
-        if self.has_food and not self.check_if_in_lead(game_state) and self.is_in_lead:
+        if self.has_food and not in_lead and self.is_in_lead:
             self.is_in_lead = False
             self.has_food = False
-            self.food_list = self.get_food(game_state).as_list()
+            self.food_count = food_count
 
         # if we ate food but got killed before we could bring it back we want to get another food pellet and bring it back
         # check if both agents are non pacman and if we have food
         team_indices = self.get_team(game_state)
         if not game_state.get_agent_state(team_indices[0]).is_pacman and not game_state.get_agent_state(
-                team_indices[1]).is_pacman and self.has_food and not self.check_if_in_lead(game_state):
+                team_indices[1]).is_pacman and self.has_food and not in_lead:
             self.has_food = False
-            self.food_list = self.get_food(game_state).as_list()
-
-        return random.choice(best_actions)
+            self.food_count = food_count
 
     def get_weights(self, game_state, action):
         """
@@ -228,26 +1913,24 @@ class SwitchingPatrolAgent(CaptureAgent):
 
     def evaluate(self, game_state, action):
         """
-        Checks if the agent should switch to another strategy and computes a linear combination of features and feature weights.
+        Computes a linear combination of features and feature weights of the current strategy.
         """
-        if self.should_switch_strategy(game_state, action):  # Switch strategy if necessary
-            self.switch_strategy()
-
         features = self.get_features(game_state, action)
         weights = self.get_weights(game_state, action)
         return features * weights
 
+    def evaluate_actions(self, game_state, actions, check_deadline=None):
+        """
+        Computes the same values as evaluate for all actions with one matrix-vector product of the current strategy.
+        """
+        return self.current_strategy.evaluate_actions(game_state, actions, check_deadline)
+
     def get_successor(self, game_state, action):
         """
         Finds the next successor which is a grid position (location tuple).
+        The successor is shared through the successor cache for the rest of the turn.
         """
-        successor = game_state.generate_successor(self.index, action)
-        pos = successor.get_agent_state(self.index).get_position()
-        if pos != nearestPoint(pos):
-            # Only half a grid position was covered
-            return successor.generate_successor(self.index, action)
-        else:
-            return successor
+        return self.successor_cache.get_successor(game_state, self.index, action)
 
     def check_if_in_lead(self, game_state):
         """
@@ -269,40 +1952,35 @@ class SwitchingPatrolAgent(CaptureAgent):
 
     def enemies_near(self, game_state):
         """
-        Returns true if there are any enemies near the agent (within 10 noisy steps).
+        Returns true if there are any enemies near the agent (within 10 expected steps).
         """
         # If Agents are observable (within 5) return true
         for enemy in self.get_opponents(game_state):
             if game_state.get_agent_position(enemy) is not None:
                 return True
 
-        # If Agents are not observable (not within 5) check how far away they are with noisy distance
-        # If distance is smaller than 10 return true
-
-        noisy_distances = game_state.get_agent_distances()
+        # If Agents are not observable (not within 5) check how far away they are expected to be
+        # from the tracked beliefs. If distance is smaller than 10 return true
+        my_pos = game_state.get_agent_position(self.index)
         for enemy in self.get_opponents(game_state):
-            if noisy_distances[enemy] < 10:
+            if self.beliefs.expected_distance(enemy, my_pos) < 10:
                 return True
         return False
 
-    def should_switch_strategy(self, game_state, action):
+    def should_switch_strategy(self, situation):
         """
-        Returns true if the agent should switch to another strategy.
+        Returns true if the agent should switch to another strategy in the given situation.
         """
-        successor = self.get_successor(game_state, action)
-
         if self.current_strategy == None:
             # If no strategy is set, set to offensive strategy
             self.switch_to_offensive()
-            return False
 
-        if self.current_strategy == self.defensive_strategy and not self.check_if_in_lead(
-                game_state) and not self.check_for_invaders(game_state) and not self.enemies_near(game_state) and not self.has_food:
+        if self.current_strategy == self.defensive_strategy and not situation.in_lead and not situation.invaders \
+                and not situation.enemies_near and not situation.has_food:
             # Switch to offensive strategy if the agent is not in lead and there are no invaders and the enemies are not near
             return True
 
-        if self.current_strategy == self.offensive_strategy and (
-                self.check_for_invaders(successor) or self.enemies_near(game_state)):
+        if self.current_strategy == self.offensive_strategy and (situation.invaders or situation.enemies_near):
             # Switch to defensive strategy if there are invaders or enemies are near
 
             return True
@@ -311,9 +1989,11 @@ class SwitchingPatrolAgent(CaptureAgent):
 
     def switch_to_offensive(self):
         self.current_strategy = self.offensive_strategy
+        self.blackboard.post(self.index, 'strategy', 'offensive')
 
     def switch_to_defensive(self):
         self.current_strategy = self.defensive_strategy
+        self.blackboard.post(self.index, 'strategy', 'defensive')
 
     def switch_strategy(self):
         if self.current_strategy == self.defensive_strategy:
@@ -327,11 +2007,33 @@ class SwitchingPatrolAgent(CaptureAgent):
 
 class DefensivePatrolling(DynamicPatrolAgent): 
     """ DynamicPatrolAgent that implements a dynamic patrol strategy, where an agent is patrolling at the border, dividing the 
-    border into two parts for the agent and its partner."""
-   
+    border into two parts for the agent and its partner.
+    The border segments and the distance of every cell to the own segment are computed once in register_initial_state.
+    If the partner posts on the blackboard that it plays offensive, the agent patrols the whole border alone."""
+
+    WEIGHTS_KEY = 'defensive'
+
+    def __init__(self, index, time_for_computing=.1, **kwargs):
+        super().__init__(index, time_for_computing, **kwargs)
+        self.border_segments = None
+        self.border_distance = None
+        self.full_border_distance = None
+        self.partner_index = None
+
+    def register_initial_state(self, game_state):
+        DynamicPatrolAgent.register_initial_state(self, game_state)
+        walls = game_state.get_walls()
+
+        # To divide the border into two parts for the two agents we need to know which inidices are in our team
+        team_indices = self.get_team(game_state)
+        self.partner_index = [i for i in team_indices if i != self.index][0]
+        self.border_segments = self.blackboard.border_segments(walls, self.red, team_indices)
+        self.border_distance = bfs_distance_field(walls, self.border_segments[self.index])
+        self.full_border_distance = self.blackboard.border_distance(walls, self.red)
 
     def get_features(self, game_state, action):
         features = util.Counter()
+        profiler = self.profiler
         successor = self.get_successor(game_state, action)
 
         my_state = successor.get_agent_state(self.index)
@@ -339,28 +2041,32 @@ class DefensivePatrolling(DynamicPatrolAgent):
 
 
         # Feature: Being defensive
-        features['on_defense'] = 1
-        if my_state.is_pacman: features['on_defense'] = -50
+        with profiler.section('feature.on_defense'):
+            features['on_defense'] = 1
+            if my_state.is_pacman: features['on_defense'] = -50
 
         # Determine if there are any invaders that need to be hunted down
-        enemies = [game_state.get_agent_state(i) for i in self.get_opponents(successor)]
-        invaders = [a for a in enemies if a.is_pacman and a.get_position() is not None]
+        with profiler.section('feature.num_invaders'):
+            enemies = [game_state.get_agent_state(i) for i in self.get_opponents(game_state)]
+            invaders = [a.get_position() for a in enemies if a.is_pacman and a.get_position() is not None]
         
-        # Feature: Number of invaders
-        features['num_invaders'] = len(invaders)
-        if len(invaders) > 0:
-           if self.distancer is not None:
-                dists= [self.get_maze_distance(my_pos, a.get_position()) for a in invaders]
-                features['invader_distance'] = min(dists)
+            # Feature: Number of invaders
+            features['num_invaders'] = len(invaders)
+            if len(invaders) > 0:
+               if self.distancer is not None:
+                    dists= [self.get_maze_distance(my_pos, a) for a in invaders]
+                    features['invader_distance'] = min(dists)
          
                
         # Feature: Patrolling at border
-        features['patrolling_at_border'] = self.patrolling_at_border(game_state, action)
+        with profiler.section('feature.patrolling_at_border'):
+            features['patrolling_at_border'] = self.patrolling_at_border(game_state, action)
         
         # Feature: Not stopping / reversing 
-        if action == Directions.STOP: features['stop'] = 1
-        rev = Directions.REVERSE[game_state.get_agent_state(self.index).configuration.direction]
-        if action == rev: features['reverse'] = 1
+        with profiler.section('feature.stop_reverse'):
+            if action == Directions.STOP: features['stop'] = 1
+            rev = Directions.REVERSE[game_state.get_agent_state(self.index).configuration.direction]
+            if action == rev: features['reverse'] = 1
 
         return features 
     
@@ -370,38 +2076,14 @@ class DefensivePatrolling(DynamicPatrolAgent):
        
         successor = self.get_successor(game_state, action)
         my_state = successor.get_agent_state(self.index)
-        my_pos = my_state.get_position()
-
-        # To divide the border into two parts for the two agents we need to know which inidices are in our team
-        team_indices = self.get_team(game_state)
-        
+        x, y = nearestPoint(my_state.get_position())
 
-        full_y_area = int(game_state.get_walls().height)
-        first_agent_y_area = int(full_y_area / 2) 
-
-        # get border position
-        if self.red:
-            border_x = int(game_state.get_walls().width / 2) - 1
-        else:
-            border_x = int(game_state.get_walls().width / 2)
-
-        # Determin the distance to the border
-        # Only the x coordinate is relevant
-        border_pos = ()
-
-        # Include all the y coordinates that are in the border area and create a list of all possible border positions
-        if self.index == team_indices[0]:
-            for y in range(first_agent_y_area):
-                if not game_state.has_wall(border_x, y):
-                    border_pos = border_pos + ((border_x, y),)
+        # The distance to the nearest position of our border segment is precomputed for every cell
+        # If the partner attacks there is nobody to share the border with
+        if self.blackboard.read(self.partner_index, 'strategy', 'defensive') == 'defensive':
+            distance_to_border = int(self.border_distance[x, y])
         else:
-            for y in range(first_agent_y_area , full_y_area):
-                if not game_state.has_wall(border_x, y):
-                    border_pos = border_pos + ((border_x, y),)
-        
-
-        # Check if the agent is near to any of the border positions and return the distance to the nearest border position
-        distance_to_border = min([self.get_maze_distance(my_pos, border) for border in border_pos])
+            distance_to_border = int(self.full_border_distance[x, y])
      
         # If the agent is near the border return a high value
         if distance_to_border < border_threshold:
@@ -409,72 +2091,123 @@ class DefensivePatrolling(DynamicPatrolAgent):
         
         return -distance_to_border # Make it negative so that the agent is rewarded for being near the border
 
-    def get_weights(self, game_state, action):
-        return {'num_invader' : -1000, 
-                'on_defense': 100, 
-                'invader_distance': -10, 
-                'patrolling_at_border': 500, 
-                'stop': -100, 
-                'reverse': -2}
-
-
 
 class OffensivePatrolling(DynamicPatrolAgent): 
     """
-    A dynamic patrol agent that carefully tries to get only a few pellets at a time and then returns to the border to patrol again."""
+    A dynamic patrol agent that carefully tries to get only a few pellets at a time and then returns to the border to patrol again.
+    The distance to the nearest food is read from a NearestFoodField that is updated once per game state.
+    Carried food is brought to the nearest cell of the own border with the ReturnPolicy of the team,
+    the return_policy=0 option brings it back to the start position instead."""
 
-     
+    WEIGHTS_KEY = 'offensive'
+
+    def __init__(self, index, time_for_computing=.1, return_policy=True, **kwargs):
+        super().__init__(index, time_for_computing, **kwargs)
+        self.food_field = None
+        self.food_field_state = None
+        self.topology = None
+        self.use_return_policy = parse_flag(return_policy)
+        self.return_policy = None
+
+    def register_initial_state(self, game_state):
+        DynamicPatrolAgent.register_initial_state(self, game_state)
+        self.food_field = NearestFoodField(game_state.get_walls(), self.get_food(game_state))
+        self.food_field_state = game_state
+        self.topology = get_maze_topology(game_state.get_walls())
+        if self.use_return_policy:
+            self.return_policy = self.blackboard.return_policy(game_state.get_walls(), self.red)
+
+    def update_food_field(self, game_state):
+        '''Updates the nearest food field with the food of the given state, once per state'''
+        if self.food_field_state is not game_state:
+            self.food_field.update(self.get_food(game_state))
+            self.food_field_state = game_state
 
     def get_features(self, game_state, action):
         features = util.Counter()
+        profiler = self.profiler
         successor = self.get_successor(game_state, action)
 
         my_state = successor.get_agent_state(self.index)
         my_pos = my_state.get_position()
       
 
-        enemies = [successor.get_agent_state(i) for i in self.get_opponents(successor)]
-        invaders = [a for a in enemies if a.is_pacman and a.get_position() is not None]
-
         # Feature: Distance to nearest enemy
-        nearest_enemy_distance = self.calculate_nearest_enemy_distance(game_state, my_pos, action)
-        features['nearest_enemy_distance'] = nearest_enemy_distance
+        with profiler.section('feature.nearest_enemy_distance'):
+            nearest_enemy_distance = self.calculate_nearest_enemy_distance(game_state, my_pos, action)
+            features['nearest_enemy_distance'] = nearest_enemy_distance
+
+        # Feature: Risk of getting trapped in a dead end
+        with profiler.section('feature.dead_end_risk'):
+            features['dead_end_risk'] = self.calculate_dead_end_risk(successor, my_state)
 
         # Feature: Careful offense
-        features['careful_offense'] = 1
-        if not my_state.is_pacman: features['careful_offense'] = 0
+        with profiler.section('feature.careful_offense'):
+            features['careful_offense'] = 1
+            if not my_state.is_pacman: features['careful_offense'] = 0
 
         # Feature: Not stopping / reversing
-        if action == Directions.STOP: features['stop'] = 1
-        rev = Directions.REVERSE[game_state.get_agent_state(self.index).configuration.direction]
-        if action == rev: features['reverse'] = 1
+        with profiler.section('feature.stop_reverse'):
+            if action == Directions.STOP: features['stop'] = 1
+            rev = Directions.REVERSE[game_state.get_agent_state(self.index).configuration.direction]
+            if action == rev: features['reverse'] = 1
 
         # Feature: Eating closest food
-        food_list = self.get_food(successor).as_list()
-        features['successor_score'] = -len(food_list)
-
-
-        if not self.has_food:
-            my_pos = successor.get_agent_state(self.index).get_position()
-            if len(food_list) > 0:  
-                min_distance = min([self.get_maze_distance(my_pos, food) for food in food_list])
-                features['distance_to_food'] = min_distance
+        with profiler.section('feature.successor_score'):
+            self.update_food_field(game_state)
+            eats_food = my_state.is_pacman and self.food_field.has_food(my_pos)
+            food_left = self.food_field.count - 1 if eats_food else self.food_field.count
+            features['successor_score'] = -food_left
+
+
+        if not self.is_carrying_food():
+            with profiler.section('feature.distance_to_food'):
+                if food_left > 0:  
+                    if eats_food:
+                        min_distance = self.food_field.distance_after_eating(my_pos)
+                    else:
+                        min_distance = self.food_field.distance(my_pos)
+                    features['distance_to_food'] = min_distance
         else:
-            # Get back home (star_position) if we have food
-            features['distance_to_home'] = self.get_maze_distance(my_pos, self.start)
+            # Get back home if we have food, to the nearest cell of our border or to the start position
+            with profiler.section('feature.distance_to_home'):
+                if self.return_policy is not None:
+                    features['distance_to_home'] = self.return_policy.distance_at(my_pos)
+                else:
+                    features['distance_to_home'] = self.get_maze_distance(my_pos, self.start)
 
         return features
 
-    def get_weights(self, game_state, action):
-        return {'num_invaders': -1000,
-                'nearest_enemy_distance': -100, 
-                'enemies_in_own_area': -1000, 
-                'careful_offense': 100, 
-                'stop': -100, 'reverse': -2, 
-                'distance_to_food': -1, 
-                'distance_to_home': -1000, 
-                'successor_score': 100}
-    
+    def break_ties(self, game_state, best_actions):
+        '''Prefers the move of the return policy among the best actions when bringing food home'''
+        if self.return_policy is not None and self.is_carrying_food():
+            move = self.return_policy.next_move(game_state.get_agent_position(self.index))
+            if move in best_actions:
+                return [move]
+        return best_actions
+
+    def calculate_dead_end_risk(self, successor, my_state):
+        '''Returns the number of steps out of the dead end the agent is in, if a visible enemy ghost is close enough to trap it there'''
+        if not my_state.is_pacman:
+            return 0
+
+        my_pos = my_state.get_position()
+        escape_distance = self.topology.escape_distance_at(my_pos)
+        if escape_distance == 0:
+            return 0
+
+        # Only visible enemy ghosts that are not scared for the way out can trap the agent, enemy pacmen can not
+        enemies = [successor.get_agent_state(i) for i in self.get_opponents(successor)]
+        ghosts = [a.get_position() for a in enemies
+                  if not a.is_pacman and a.scared_timer <= escape_distance and a.get_position() is not None]
+        if len(ghosts) == 0:
+            return 0
+
+        # The ghost can block the way out if it is not further away than the way out and back
+        if min(self.get_maze_distance(my_pos, pos) for pos in ghosts) <= 2 * escape_distance + 1:
+            return escape_distance
+        return 0
+
     def calculate_nearest_enemy_distance(self, game_state, my_pos, action):
         '''Calculates the distance to the nearest enemy agent'''
         successor = self.get_successor(game_state, action)
@@ -483,16 +2216,15 @@ class OffensivePatrolling(DynamicPatrolAgent):
         enemies = [successor.get_agent_state(i) for i in self.get_opponents(successor)]
         near_enemies = [a for a in enemies if a.get_position() is not None]
 
-        # If enemies are not near we only know their noisy distance
+        # If enemies are not near we use their most likely position from the tracked beliefs
         enemy_indices = self.get_opponents(game_state)
-        noisy_distances = game_state.get_agent_distances()
-        noisy_enemies = [noisy_distances[i] for i in enemy_indices]
+        current_pos = game_state.get_agent_position(self.index)
         
-        # Check if enemies are near and return noise distance if not 
+        # Check if enemies are near and return the distance to the most likely positions if not
         if len(near_enemies) > 0:
             distances = [self.get_maze_distance(my_pos, a.get_position()) for a in near_enemies]
         else :
-            distances = noisy_enemies
+            distances = [self.get_maze_distance(current_pos, self.beliefs.most_likely_position(i)) for i in enemy_indices]
         return min(distances)
     
       
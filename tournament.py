@@ -0,0 +1,162 @@
+# tournament.py
+# -------------
+# Parallel tournament of two agent classes of myTeam.py.
+#
+# Runs N seeded, headless games per layout on all CPU cores. Every agent class plays half of
+# the games as red and half as blue. Each result is appended to a line-delimited JSON file as
+# soon as its game finishes, so an interrupted tournament can be resumed with the same command.
+# At the end the win rates with 95% confidence intervals are printed.
+#
+#   python tournament.py SwitchingPatrolAgent DynamicPatrolAgent -n 40 -l defaultCapture officeCapture
+#   python tournament.py SwitchingPatrolAgent SwitchingPatrolAgent --first-opts search=alphabeta
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+TEAM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'myTeam.py')
+
+
+def team_options(agent_class, options):
+    """
+    Returns the --redOpts/--blueOpts string that makes create_team build two agents of the class.
+    """
+    team = 'first=%s,second=%s' % (agent_class, agent_class)
+    if options:
+        team += ',' + options
+    return team
+
+
+def play_game(job):
+    """
+    Plays one headless game and returns the job with the final score added.
+    Runs in a worker process.
+    """
+    from contest import capture
+
+    if job['swap']:
+        red, blue = job['second'], job['first']
+    else:
+        red, blue = job['first'], job['second']
+
+    random.seed(job['seed'])
+    argv = ['-r', TEAM_FILE, '-b', TEAM_FILE,
+            '--redOpts', team_options(red['agent'], red['options']),
+            '--blueOpts', team_options(blue['agent'], blue['options']),
+            '-l', job['layout'], '-n', '1', '-Q']
+    # The games print their progress, keep the output of the workers quiet
+    with contextlib.redirect_stdout(io.StringIO()):
+        options = capture.read_command(argv)
+        games = capture.run_games(**options)
+
+    result = dict(job)
+    result['score'] = games[0].state.data.score
+    # A positive score is a win of red, express the result from the view of the first agent
+    first_score = -result['score'] if job['swap'] else result['score']
+    result['winner'] = 'first' if first_score > 0 else 'second' if first_score < 0 else 'tie'
+    return result
+
+
+def job_key(job):
+    return job['layout'], job['seed'], job['swap']
+
+
+def create_jobs(first, second, layouts, num_games, seed):
+    """
+    Returns the jobs of the tournament, the agents swap colors on every other game.
+    """
+    jobs = []
+    for layout in layouts:
+        for game in range(num_games):
+            jobs.append({'layout': layout, 'seed': seed + game, 'swap': game % 2 == 1,
+                         'first': first, 'second': second})
+    return jobs
+
+
+def load_results(path):
+    """
+    Returns the results already stored in the results file.
+    """
+    results = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    results.append(json.loads(line))
+    return results
+
+
+def wilson_interval(successes, trials, z=1.96):
+    """
+    Returns the Wilson score interval of a win rate, ties count as half a win.
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    rate = successes / trials
+    denominator = 1 + z * z / trials
+    center = (rate + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def summarize(results, first, second):
+    """
+    Prints the win rate of the first agent per layout and overall.
+    """
+    layouts = sorted(set(r['layout'] for r in results))
+    print('%s vs %s' % (first['agent'], second['agent']))
+    for layout in layouts + [None]:
+        games = [r for r in results if layout is None or r['layout'] == layout]
+        wins = sum(1 for r in games if r['winner'] == 'first')
+        losses = sum(1 for r in games if r['winner'] == 'second')
+        ties = len(games) - wins - losses
+        rate = (wins + 0.5 * ties) / len(games) if games else 0.0
+        low, high = wilson_interval(wins + 0.5 * ties, len(games))
+        print('%-20s %4d games  %4d W %4d L %4d T  win rate %.3f  95%% CI [%.3f, %.3f]' % (
+            layout or 'all', len(games), wins, losses, ties, rate, low, high))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Parallel tournament of two agent classes of myTeam.py')
+    parser.add_argument('first', help='agent class of the first team, e.g. SwitchingPatrolAgent')
+    parser.add_argument('second', help='agent class of the second team, e.g. DynamicPatrolAgent')
+    parser.add_argument('--first-opts', default='', help='agent options of the first team, e.g. search=alphabeta')
+    parser.add_argument('--second-opts', default='', help='agent options of the second team')
+    parser.add_argument('-l', '--layouts', nargs='+', default=['defaultCapture'], help='capture layouts to play')
+    parser.add_argument('-n', '--games', type=int, default=20, help='number of games per layout')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the first game')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-o', '--output', default='tournament_results.jsonl', help='line-delimited results file')
+    options = parser.parse_args(argv)
+
+    first = {'agent': options.first, 'options': options.first_opts}
+    second = {'agent': options.second, 'options': options.second_opts}
+    jobs = create_jobs(first, second, options.layouts, options.games, options.seed)
+
+    # Resume: games of the same tournament that are in the results file already are not played again
+    results = [r for r in load_results(options.output) if r['first'] == first and r['second'] == second]
+    done = set(job_key(r) for r in results)
+    jobs = [job for job in jobs if job_key(job) not in done]
+    print('%d games to play, %d already done' % (len(jobs), len(done)))
+
+    with open(options.output, 'a') as output, ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        futures = [executor.submit(play_game, job) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            results.append(result)
+            print('%-20s seed %5d  %s' % (result['layout'], result['seed'], result['winner']))
+
+    summarize([r for r in results if r['layout'] in options.layouts], first, second)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
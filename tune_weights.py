@@ -0,0 +1,158 @@
+# tune_weights.py
+# ---------------
+# Parallel self-play tuner of the strategy weight tables in weights.json.
+#
+# The weights of DefensivePatrolling and OffensivePatrolling are searched with the cross-entropy
+# method: every generation samples candidate weight sets from a normal distribution, plays each
+# candidate (as a SwitchingPatrolAgent team) against the start weights (--weights) in a batch of
+# headless games on a process pool, and refits the distribution to the best candidates.
+#
+# The state of the search is checkpointed to the run directory after every generation, so an
+# interrupted run continues where it stopped when started again with the same run directory.
+#
+#   python tune_weights.py --run-dir tuning/run1 --generations 30 --population 16 --games 8
+#
+# The best weights found so far are in <run-dir>/best_weights.json, in the format of weights.json.
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tournament import play_game
+
+WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weights.json')
+# The weight tables that are tuned, the others are copied from the start weights
+TUNED_TABLES = ['defensive', 'offensive']
+
+
+def flatten(tables):
+    """
+    Returns the (table, feature) names and the values of the tuned weights.
+    """
+    names = [(table, feature) for table in TUNED_TABLES for feature in sorted(tables[table])]
+    return names, np.array([tables[table][feature] for table, feature in names], dtype=np.float64)
+
+
+def unflatten(names, values, start_tables):
+    """
+    Returns a copy of the start weight tables with the tuned weights replaced by the given values.
+    """
+    tables = json.loads(json.dumps(start_tables))
+    for (table, feature), value in zip(names, values):
+        tables[table][feature] = round(float(value), 3)
+    return tables
+
+
+def write_json(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def evaluate_candidates(candidate_files, reference_file, layouts, games, seed, executor):
+    """
+    Plays every candidate against the reference weights file and returns the mean score of each candidate.
+    All games of all candidates of the generation run on the process pool at once.
+    """
+    jobs = []
+    for candidate, path in enumerate(candidate_files):
+        for layout in layouts:
+            for game in range(games):
+                jobs.append((candidate, {
+                    'layout': layout, 'seed': seed + game, 'swap': game % 2 == 1,
+                    'first': {'agent': 'SwitchingPatrolAgent', 'options': 'weights=%s' % path},
+                    'second': {'agent': 'SwitchingPatrolAgent', 'options': 'weights=%s' % reference_file}}))
+
+    scores = [[] for _ in candidate_files]
+    futures = [(candidate, executor.submit(play_game, job)) for candidate, job in jobs]
+    for candidate, future in futures:
+        result = future.result()
+        # The score is positive for red, express it from the view of the candidate
+        scores[candidate].append(-result['score'] if result['swap'] else result['score'])
+    return [float(np.mean(s)) for s in scores]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Tune the strategy weights with the cross-entropy method')
+    parser.add_argument('--run-dir', default='tuning', help='directory of the checkpoint and the candidates')
+    parser.add_argument('--weights', default=WEIGHTS_FILE, help='start and reference weights')
+    parser.add_argument('-g', '--generations', type=int, default=20, help='number of generations')
+    parser.add_argument('-p', '--population', type=int, default=16, help='candidates per generation')
+    parser.add_argument('-e', '--elite', type=float, default=0.25, help='fraction of candidates the distribution is fit to')
+    parser.add_argument('-n', '--games', type=int, default=8, help='games per candidate and layout')
+    parser.add_argument('-l', '--layouts', nargs='+', default=['defaultCapture'], help='capture layouts to play')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='random seed of the search')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    options = parser.parse_args(argv)
+
+    os.makedirs(options.run_dir, exist_ok=True)
+    checkpoint_path = os.path.join(options.run_dir, 'checkpoint.json')
+    with open(options.weights) as f:
+        start_tables = json.load(f)
+    names, start_values = flatten(start_tables)
+    reference_file = os.path.abspath(options.weights)
+
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        print('Resuming from generation %d' % checkpoint['generation'])
+    else:
+        checkpoint = {'generation': 0,
+                      'mean': start_values.tolist(),
+                      # The weights differ by orders of magnitude, so the spread is relative to each weight
+                      'std': (0.5 * np.abs(start_values) + 1.0).tolist(),
+                      'best_score': None,
+                      'best_values': start_values.tolist(),
+                      'history': []}
+
+    rng = np.random.default_rng(options.seed)
+    # Advance the random generator past the generations that are done already
+    for _ in range(checkpoint['generation']):
+        rng.standard_normal((options.population, len(names)))
+
+    num_elite = max(1, int(round(options.elite * options.population)))
+    with ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        while checkpoint['generation'] < options.generations:
+            generation = checkpoint['generation']
+            mean = np.array(checkpoint['mean'])
+            std = np.array(checkpoint['std'])
+            samples = mean + std * rng.standard_normal((options.population, len(names)))
+
+            candidate_dir = os.path.join(options.run_dir, 'generation%03d' % generation)
+            os.makedirs(candidate_dir, exist_ok=True)
+            candidate_files = []
+            for candidate, values in enumerate(samples):
+                path = os.path.abspath(os.path.join(candidate_dir, 'candidate%03d.json' % candidate))
+                write_json(path, unflatten(names, values, start_tables))
+                candidate_files.append(path)
+
+            scores = evaluate_candidates(candidate_files, reference_file, options.layouts, options.games,
+                                         options.seed + generation * options.games, executor)
+
+            elite = np.argsort(scores)[::-1][:num_elite]
+            checkpoint['mean'] = samples[elite].mean(axis=0).tolist()
+            # Keep a minimum spread so the search does not collapse too early
+            checkpoint['std'] = np.maximum(samples[elite].std(axis=0), 0.05 * np.abs(mean) + 0.1).tolist()
+            best = int(elite[0])
+            if checkpoint['best_score'] is None or scores[best] > checkpoint['best_score']:
+                checkpoint['best_score'] = scores[best]
+                checkpoint['best_values'] = samples[best].tolist()
+                write_json(os.path.join(options.run_dir, 'best_weights.json'),
+                           unflatten(names, samples[best], start_tables))
+            checkpoint['history'].append({'generation': generation, 'best': scores[best],
+                                          'mean': float(np.mean(scores))})
+            checkpoint['generation'] = generation + 1
+            write_json(checkpoint_path, checkpoint)
+            print('generation %3d  best %7.2f  mean %7.2f  overall best %7.2f' % (
+                generation, scores[best], np.mean(scores), checkpoint['best_score']))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))